@@ -1,16 +1,20 @@
 """ Run the default runner and show results """
+import os
 import time
 
 from src.defaults import default_runner
 from src.graphs.map import draw_network
 
 COUNT = 1
+WORKERS = os.cpu_count() or 1
 
 if __name__ == '__main__':
     print(f'Running default runner ({default_runner.name})'
           f' {COUNT} time{"s" if COUNT > 1 else ""}...')
     start = time.time()
 
+    default_runner.workers = WORKERS
+
     solution = default_runner.best(COUNT)
 
     print(f'Took {time.time() - start:.1f} seconds')
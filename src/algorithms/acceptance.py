@@ -0,0 +1,48 @@
+""" Acceptance criteria for iterative algorithms, deciding whether to move
+    from the current quality to a candidate quality, given the progress
+    of the search (from 0 at the start to 1 at the end)                  """
+
+from math import exp
+from random import random
+
+from src.classes.abstract import Acceptance
+
+
+def improving() -> Acceptance:
+    """ Only accepts strictly better candidates """
+
+    def _improving(current: float, candidate: float, _: float) -> bool:
+        return candidate > current
+
+    return _improving
+
+
+def non_worsening() -> Acceptance:
+    """ Accepts candidates that are at least as good, allowing sideways moves """
+
+    def _non_worsening(current: float, candidate: float, _: float) -> bool:
+        return candidate >= current
+
+    return _non_worsening
+
+
+def threshold(margin: float) -> Acceptance:
+    """ Accepts candidates worse by at most 'margin', shrinking to 0 at the end """
+
+    def _threshold(current: float, candidate: float, progress: float) -> bool:
+        return candidate >= current - margin * (1 - progress)
+
+    return _threshold
+
+
+def annealing(schedule: float = 10) -> Acceptance:
+    """ Accepts worse candidates with a probability like SimulatedAnnealing,
+        with a temperature falling linearly from 'schedule' to 0            """
+
+    def _annealing(current: float, candidate: float, progress: float) -> bool:
+        if candidate >= current:
+            return True
+        temp = schedule * (1 - progress)
+        return temp > 0 and random() < exp((candidate - current) / temp)
+
+    return _annealing
@@ -1,41 +1,42 @@
 """ Adjustment functions to run on heuristic outputs """
 
-from heapq import nlargest
-from math import exp
+import numpy as np
 
-from src.classes.abstract import Adjuster
+from src.classes.abstract import Adjuster, Weights
 
 
-def relu(weights: list[float]) -> list[float]:
+def relu(weights: Weights) -> np.ndarray:
     """ Makes all weights zero or positive """
-    return [max(0., w) for w in weights]
+    return np.maximum(np.asarray(weights, dtype=float), 0.)
 
 
-def argmax(weights: list[float]) -> list[float]:
+def argmax(weights: Weights) -> np.ndarray:
     """ Concentrates all probability into the highest weight """
-    best = max(weights)
-    return [(1 if w == best else 0) for w in weights]
+    weights = np.asarray(weights, dtype=float)
+    return (weights == weights.max()).astype(float)
 
 
-def softmax(weights: list[float]) -> list[float]:
+def softmax(weights: Weights) -> np.ndarray:
     """ Performs a softmax on the weights """
-    exp_weights = [exp(w) for w in weights]
-    sum_exp = sum(exp_weights)
-    return [e / sum_exp for e in exp_weights]
+    exp_weights = np.exp(np.asarray(weights, dtype=float))
+    return exp_weights / exp_weights.sum()
 
 
 def soft_n(top_n: int) -> Adjuster:
     """ Create an adjuster that
         performs a softmax preferring the top n choices """
 
-    def _soft_n(weights: list[float]) -> list[float]:
+    def _soft_n(weights: Weights) -> np.ndarray:
         """ Performs a softmax preferring the top n choices """
-        top = nlargest(top_n + 1, weights)
-        low = min(top)
-        high = max(top)
+        weights = np.asarray(weights, dtype=float)
+        high = weights.max()
+        if len(weights) > top_n + 1:
+            low = np.partition(weights, -top_n - 1)[-top_n - 1]
+        else:
+            low = weights.min()
         if low == high or high > low + 200:
             # Argmax if we can't reduce due to similar scores or math domain
-            return [(1 if w == high else 0) for w in weights]
-        return softmax(relu([w - low for w in weights]))
+            return (weights == high).astype(float)
+        return softmax(relu(weights - low))
 
     return _soft_n
@@ -0,0 +1,110 @@
+""" Ant colony optimisation, with pheromone kept per rail """
+
+from __future__ import annotations
+
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from src.algorithms import adjusters, heuristics
+from src.algorithms.generic import Constructive
+from src.classes.abstract import Algorithm, Heuristic, Adjuster
+from src.classes.bounds import quality_bound
+from src.classes.lines import Network, MoveBatch
+from src.classes.rails import CompiledRails
+
+# Pheromone trails per compiled infrastructure, kept across runs
+_trails: WeakKeyDictionary[CompiledRails, np.ndarray] = WeakKeyDictionary()
+
+
+class Ant(Constructive):
+    """ Constructive algorithm whose batched move weights are multiplied
+        by the pheromone on the rail of each extension, to the power alpha """
+    name = 'ant'
+
+    def __init__(self, base: Network, heur: Heuristic, adj: Adjuster,
+                 trail: np.ndarray, alpha: float = 1., **options):
+        super().__init__(base, heur, adj, **options)
+        self.trail = trail
+        self.alpha = alpha
+
+    def batch_weights(self, batch: MoveBatch) -> np.ndarray:
+        weights = super().batch_weights(batch)
+        weights[:batch.extensions()] *= self.trail[batch.edge] ** self.alpha
+        return weights
+
+
+class AntColony(Algorithm):
+    """ Ant colony optimisation (MAX-MIN style): each iteration, 'ants' ants
+        build networks from the base network with a batched heuristic
+        (default next_free) weighted by pheromone. The pheromone on all
+        rails then evaporates by a fraction 'rho', and the best ant of the
+        iteration and the best network so far split a deposit on their
+        rails by their quality (relative to the quality bound), with the
+        pheromone kept between 'min_ratio' / rho and 1 / rho. Unless
+        'shared' is False, the pheromone is kept per infrastructure, so
+        later runs learn from earlier ones. The best network is given as
+        the active network                                                 """
+    name = 'ac'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.iter = 0
+        self.iter_cap = options.get('iter_cap', 20)
+        self.line_cap = options.get('line_cap', 7)
+        self.ants = options.get('ants', 10)
+        self.alpha = options.get('alpha', 1.)
+        self.rho = options.get('rho', .1)
+        self.heur = options.get('heur', heuristics.next_free(self.line_cap))
+        if getattr(self.heur, 'batch', None) is None:
+            raise ValueError('AntColony -> heur must have a batch function')
+        self.adj = options.get('adj', adjusters.soft_n(6))
+        self.rng = np.random.default_rng(options.get('seed'))
+
+        self.high = 1 / self.rho
+        self.low = options.get('min_ratio', .05) * self.high
+        edges = len(base.graph.edge_duration)
+        if options.get('shared', True):
+            if base.graph not in _trails:
+                _trails[base.graph] = np.full(edges, self.high)
+            self.trail = _trails[base.graph]
+        else:
+            self.trail = np.full(edges, self.high)
+        self.bound = quality_bound(base.graph, self.line_cap, base.dist_cap) or 1.
+
+        self.base = base.copy()
+        self.best = base
+
+    def construct(self) -> Network:
+        """ Build a single network with an ant """
+        net = self.base.copy()
+        ant = Ant(net, self.heur, self.adj, self.trail, self.alpha,
+                  line_cap=self.line_cap, seed=self.rng.integers(1 << 32))
+        for _ in ant:
+            pass
+        net.trim()
+        return net
+
+    def deposit(self, networks: list[Network]):
+        """ Evaporate the pheromone, then let networks deposit on their rails """
+        covered = np.array([np.frombuffer(net.link_count, dtype=np.uint16) > 0
+                            for net in networks], dtype=float)
+        # Deposits sum to at most 1, so only consistently used rails reach the maximum
+        amounts = np.array([max(net.quality(), 0.) / self.bound for net in networks])
+        amounts /= len(networks)
+        self.trail *= 1 - self.rho
+        self.trail += amounts @ covered
+        np.clip(self.trail, self.low, self.high, out=self.trail)
+
+    def __next__(self) -> Network:
+        if self.iter >= self.iter_cap:
+            raise StopIteration
+        self.iter += 1
+
+        colony = [self.construct() for _ in range(self.ants)]
+        best = max(colony)
+        if best.quality() > self.best.quality():
+            self.best = best
+        self.deposit([best, self.best])
+        self.active = self.best
+        return self.active
@@ -3,15 +3,24 @@
 from __future__ import annotations
 
 import random
+from typing import Collection
+
+import numpy as np
 
 from src.algorithms import adjusters
 from src.classes.abstract import Algorithm, Heuristic, Adjuster, Move
-from src.classes.lines import Network
+from src.classes.frontier import Frontier
+from src.classes.lines import Network, MoveBatch
+from src.classes.moves import ExtensionMove
 
 
 class Constructive(Algorithm):
     """ Generic constructive algorithm, chooses using a
-        heuristic and normalisation                     """
+        heuristic and normalisation. Heuristics with a
+        'batch' function are evaluated on all moves at once.
+        With the 'frontier' option, the highest scoring move
+        is taken from an incrementally kept Frontier instead,
+        which behaves like adjusters.argmax                  """
     name = 'cn'
 
     def __init__(self, base: Network, heur: Heuristic,
@@ -20,22 +29,58 @@ class Constructive(Algorithm):
         self.infra = base.rails
         self.line_cap = options.get('line_cap', 7)
         self.heur = heur
+        self.batch_heur = getattr(heur, 'batch', None)
         self.adj = adj
+        self.rng = np.random.default_rng(options.get('seed'))
+        self.frontier = None
+        if options.get('frontier', False):
+            self.frontier = Frontier(self.active, heur, self.line_cap)
 
-    def next_move(self) -> Move | None:
+    def next_move(self, lines: Collection[int] | None = None,
+                  can_add: bool | None = None) -> Move | None:
         """
         Constructively add to the network
+        :param lines: Locations of the lines that may be extended, default all
+        :param can_add: Whether lines may be added, default while under the line cap
         :return: Moves, or None if there are none remaining
         """
-        can_add = len(self.active.lines) < self.line_cap
+        if self.frontier is not None:
+            if lines is not None or can_add is not None:
+                raise ValueError('Constructive -> frontier moves cannot be restricted')
+            return self.frontier.pop()
+        if can_add is None:
+            can_add = len(self.active.lines) < self.line_cap
+        if self.batch_heur is not None:
+            return self._next_batched(can_add, lines)
         moves = list(self.active.constructions(can_add))
+        if lines is not None:
+            moves = [mv for mv in moves
+                     if not isinstance(mv, ExtensionMove) or mv.line.location in lines]
         if not moves:
             return None
         weights = self.adj([self.heur(self.active, mv) for mv in moves])
-        if not any(weights):
+        if not np.any(weights):
             return None
         return random.choices(moves, weights=weights, k=1)[0]
 
+    def batch_weights(self, batch: MoveBatch) -> np.ndarray:
+        """ The adjusted weights of all moves in a batch """
+        return self.adj(self.batch_heur(self.active, batch))
+
+    def _next_batched(self, can_add: bool, lines: Collection[int] | None) -> Move | None:
+        """ Choose the next move through the batch heuristic """
+        batch = self.active.batch(can_add)
+        if lines is not None:
+            batch = batch.only(lines)
+        if not len(batch):
+            return None
+        weights = self.batch_weights(batch)
+        cumulative = np.cumsum(weights)
+        if not cumulative[-1] > 0:
+            return None
+        index = np.searchsorted(cumulative, self.rng.random() * cumulative[-1], side='right')
+        return batch.move(min(int(index), len(batch) - 1))
+
     def __next__(self) -> Network:
         """ Get the next intermediate state """
         if self.active.fully_covered():
@@ -43,5 +88,8 @@ class Constructive(Algorithm):
         mov = self.next_move()
         if mov is None:
             raise StopIteration
-        mov.commit()
+        if self.frontier is not None:
+            self.frontier.commit(mov)
+        else:
+            mov.commit()
         return self.active
@@ -0,0 +1,176 @@
+""" Genetic algorithm, recombining the lines of a population of networks """
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing as mp
+import os
+import random
+
+from src.algorithms import adjusters, heuristics
+from src.algorithms.generic import Constructive
+from src.algorithms.standard import Greedy
+from src.classes.abstract import Algorithm
+from src.classes.lines import Network, NetworkState, CompactState
+from src.classes.rails import Rails, CompiledRails
+
+# The infrastructure, dist_cap, line_cap and mutation size of a worker process
+_setup: tuple[Rails, int, int, int] | None = None
+
+# The worker pool kept between instances, by the configuration it was set up for
+_pool: tuple[tuple[CompiledRails, int, int, int, int], mp.pool.Pool] | None = None
+
+
+def _init_worker(rails: Rails, dist_cap: int, line_cap: int, mutation_size: int):
+    """ Give a worker process its configuration, and its own random state """
+    global _setup
+    _setup = rails, dist_cap, line_cap, mutation_size
+    random.seed()
+
+
+def _worker_pool(rails: Rails, dist_cap: int, line_cap: int,
+                 mutation_size: int, workers: int) -> mp.pool.Pool:
+    """ A pool of 'workers' processes set up for the given configuration, kept
+        between instances, so repeated runs don't each start their own. The
+        pool is replaced for another configuration or modified infrastructure """
+    global _pool
+    key = rails.compile(), dist_cap, line_cap, mutation_size, workers
+    if _pool is not None and _pool[0][0] is key[0] and _pool[0][1:] == key[1:]:
+        return _pool[1]
+    _close_pool()
+    methods = mp.get_all_start_methods()
+    context = mp.get_context('fork' if 'fork' in methods else None)
+    _pool = key, context.Pool(workers, _init_worker, (rails, dist_cap, line_cap, mutation_size))
+    return _pool[1]
+
+
+@atexit.register
+def _close_pool():
+    """ Stop the kept worker pool, if any """
+    global _pool
+    if _pool is not None:
+        _pool[1].terminate()
+        _pool = None
+
+
+def breed(first: NetworkState, second: NetworkState, mutate: bool,
+          dist_cap: int, line_cap: int, mutation_size: int) -> NetworkState:
+    """
+    Create a child network from two parents
+    :param first: The first parent
+    :param second: The second parent
+    :param mutate: Whether to take random moves before repairing the child
+    :param dist_cap: The maximum duration of any single line
+    :param line_cap: The maximum amount of lines
+    :param mutation_size: How many random moves a mutation takes
+    :return: The child, which takes (about) half of the lines of each parent,
+             then is trimmed and extended greedily to repair its coverage
+    """
+    lines = [line for line in first.lines + second.lines if random.random() < .5]
+    random.shuffle(lines)
+    net = Network.from_lines(lines[:line_cap], first.infra, dist_cap)
+
+    if mutate:
+        for _ in range(mutation_size):
+            move = net.random_move(line_cap)
+            if move is not None:
+                move.commit()
+
+    net.trim()
+    for _ in Greedy(net, line_cap=line_cap):
+        pass
+    net.trim()
+    return NetworkState.from_network(net)
+
+
+def _breed(task: tuple[CompactState, CompactState, bool]) -> CompactState:
+    """ Worker function: breed a child from two compact parents """
+    first, second, mutate = task
+    rails, dist_cap, line_cap, mutation_size = _setup
+    return breed(NetworkState.from_compact(first, rails),
+                 NetworkState.from_compact(second, rails),
+                 mutate, dist_cap, line_cap, mutation_size).compact()
+
+
+class Genetic(Algorithm):
+    """ Genetic algorithm over a population of 'population' networks, started
+        from the base network and Constructive (next_free) networks. Each
+        generation keeps the 'elite' best networks, and fills the rest with
+        children of parents chosen by tournaments of 'tournament' networks.
+        Children mix whole lines of their parents, are mutated with chance
+        'mutation', and are bred in 'processes' processes (default 1, kept
+        between instances).
+        Networks equal to one already in the population (see NetworkState)
+        are not added. The best network is given as the active network              """
+    name = 'ga'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.iter = 0
+        self.iter_cap = options.get('iter_cap', 30)
+        self.line_cap = options.get('line_cap', 7)
+        self.size = options.get('population', 20)
+        self.elite = options.get('elite', 2)
+        self.tournament = options.get('tournament', 3)
+        self.mutation = options.get('mutation', .3)
+        self.mutation_size = options.get('mutation_size', 5)
+
+        # Networks as states, so duplicates are only kept once
+        self.population: set[NetworkState] = {NetworkState.from_network(base)}
+        heur = heuristics.next_free(self.line_cap)
+        for _ in range(4 * self.size):
+            if len(self.population) >= self.size:
+                break
+            net = Network(base.rails, base.dist_cap)
+            for _ in Constructive(net, heur, adjusters.soft_n(6), line_cap=self.line_cap):
+                pass
+            net.trim()
+            self.population.add(NetworkState.from_network(net))
+
+        self.pool = None
+        workers = min(options.get('processes', 1), os.cpu_count() or 1)
+        # Processes of a worker pool (see Runner) can't start their own
+        if workers > 1 and not mp.current_process().daemon:
+            self.pool = _worker_pool(base.rails, base.dist_cap, self.line_cap,
+                                     self.mutation_size, workers)
+
+    def select(self) -> NetworkState:
+        """ The best network of a random tournament of the population """
+        entrants = random.sample(list(self.population),
+                                 min(self.tournament, len(self.population)))
+        return max(entrants, key=lambda state: state.score)
+
+    def children(self, count: int) -> list[NetworkState]:
+        """ Breed 'count' children from the population """
+        pairs = [(self.select(), self.select(), random.random() < self.mutation)
+                 for _ in range(count)]
+        if self.pool is not None:
+            tasks = [(first.compact(), second.compact(), mutate)
+                     for first, second, mutate in pairs]
+            rails = self.active.rails
+            return [NetworkState.from_compact(child, rails)
+                    for child in self.pool.map(_breed, tasks)]
+        return [breed(first, second, mutate, self.active.dist_cap,
+                      self.line_cap, self.mutation_size)
+                for first, second, mutate in pairs]
+
+    def __next__(self) -> Network:
+        if self.iter >= self.iter_cap:
+            raise StopIteration
+        self.iter += 1
+
+        ranked = sorted(self.population, key=lambda state: state.score, reverse=True)
+        population = set(ranked[:self.elite])
+        # Duplicates are dropped, so a few extra rounds of children may be needed
+        for _ in range(3):
+            if len(population) >= self.size:
+                break
+            for child in self.children(self.size - len(population)):
+                population.add(child)
+        self.population = population
+
+        best = max(population, key=lambda state: state.score)
+        deadline = self.active.deadline
+        self.active = Network.from_state(best, self.active.dist_cap)
+        self.active.deadline = deadline
+        return self.active
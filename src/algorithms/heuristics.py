@@ -1,10 +1,21 @@
-""" Heuristic functions of state and move for generic algorithms """
+""" Heuristic functions of state and move for generic algorithms.
+    Heuristics may also offer a 'batch' function, scoring all
+    constructive moves of a network at once (see abstract.BatchHeuristic) """
 
 import random
 
-from src.classes.abstract import Move, Heuristic
-from src.classes.lines import Network
+import numpy as np
+
+from src.classes.abstract import Move, Heuristic, DeadlineExceeded
+from src.classes.lines import Network, MoveBatch
 from src.classes.moves import ExtensionMove, AdditionMove
+from src.classes.transposition import TranspositionTable
+
+
+def _with_additions(net: Network, batch: MoveBatch,
+                    extensions: np.ndarray, line_cap: int) -> np.ndarray:
+    """ Append the weights of the additions in batch to those of its extensions """
+    return np.concatenate((extensions, np.full(len(batch.roots), float(len(net.lines) < line_cap))))
 
 
 def rand(line_cap: int = 20) -> Heuristic:
@@ -15,6 +26,13 @@ def rand(line_cap: int = 20) -> Heuristic:
             return 0
         return random.random() + 1
 
+    def _batch(net: Network, batch: MoveBatch) -> np.ndarray:
+        weights = np.random.random(len(batch)) + 1
+        if len(net.lines) >= line_cap:
+            weights[batch.extensions():] = 0
+        return weights
+
+    _rand.batch = _batch
     return _rand
 
 
@@ -28,33 +46,55 @@ def greedy(line_cap: int = 20) -> Heuristic:
             return len(net.lines) < line_cap
         return 0
 
+    def _batch(net: Network, batch: MoveBatch) -> np.ndarray:
+        return _with_additions(net, batch, 100 * (1 + batch.new) - batch.duration, line_cap)
+
+    _greedy.batch = _batch
     return _greedy
 
 
-def full_lookahead(line_cap: int = 20, depth: int = 2,
-                   constructive: bool = True) -> Heuristic:
-    """ 'Depth'-optimal heuristic, looks ahead at possible moves """
+def full_lookahead(line_cap: int = 20, depth: int = 2, constructive: bool = True,
+                   table: TranspositionTable | None = None) -> Heuristic:
+    """ 'Depth'-optimal heuristic, looks ahead at possible moves.
+        Results are cached in 'table' (by default a new table),
+        which is shared by every use of the heuristic             """
+    if table is None:
+        table = TranspositionTable()
 
     def _full_lookahead(net: Network, _depth: int) -> float:
-        """ Performs lookahead to 'depth' """
+        """ Performs lookahead to 'depth', leaving net unchanged """
         if _depth < 1:
             return net.quality()
+        if net.expired():
+            raise DeadlineExceeded
+        stored = table.lookup(net.key, _depth)
+        if stored is not None:
+            return stored
 
-        return max(net.quality(), max(
-            (_full_lookahead(state_neighbour, _depth - 1)
-             for state_neighbour in
-             net.state_neighbours(line_cap, stationary=False, constructive=constructive)),
-            default=0
-        ))
+        highest = net.quality()
+        if _depth == 1:
+            # Leaves can be scored without being built
+            highest += max(0., max(
+                (move.delta_quality() for move in net.neighbour_moves(line_cap, constructive)),
+                default=0.))
+        else:
+            for move in net.neighbour_moves(line_cap, constructive):
+                net.apply(move)
+                highest = max(_full_lookahead(net, _depth - 1), highest)
+                net.undo()
+        table.store(net.key, _depth, highest)
+        return highest
 
     def _entry(origin: Network, mov: Move) -> float:
         """ Entrypoint for the heuristic, initialises values """
-        net = origin.copy()
-        mov.rebind(net).commit()
+        table.bind(origin.graph)
+        origin.apply(mov)
         highest = 0.
-        for state_neighbor in net.state_neighbours(
-                line_cap, constructive=constructive, stationary=False):
-            highest = max(_full_lookahead(state_neighbor, depth - 1), highest)
+        for move in origin.neighbour_moves(line_cap, constructive):
+            origin.apply(move)
+            highest = max(_full_lookahead(origin, depth - 1), highest)
+            origin.undo()
+        origin.undo()
 
         return highest
 
@@ -75,26 +115,37 @@ def branch_bound(line_cap: int = 20, depth: int = 2,
 
     def _branch(net: Network, _depth: int, highest: float) -> float:
         """ Analyse all state neighbours of net, checking if they improve highest """
-        if _depth > 0:
-            for state_neighbor in net.state_neighbours(
-                    line_cap, constructive=constructive, stationary=False):
-                score = state_neighbor.quality()
-                if score + _bound(state_neighbor, _depth - 1) <= highest:
-                    # Cut the branch
-                    continue
-                highest = max(_branch(state_neighbor, _depth - 1, score), highest)
+        if net.expired():
+            raise DeadlineExceeded
+        if _depth == 1:
+            # Leaves can't be cut, and can be scored without being built
+            base = net.quality()
+            return max(highest, max(
+                (base + move.delta_quality() for move in
+                 net.neighbour_moves(line_cap, constructive)),
+                default=highest))
+        if _depth > 1:
+            for move in net.neighbour_moves(line_cap, constructive):
+                net.apply(move)
+                score = net.quality()
+                # Cut the branch if it can't beat highest
+                if score + _bound(net, _depth - 1) > highest:
+                    highest = max(_branch(net, _depth - 1, score), highest)
+                net.undo()
 
         return highest
 
     def _entry(origin: Network, mov: Move) -> float:
         """ Entrypoint for the heuristic, initialises values """
-        net = origin.copy()
-        mov.rebind(net).commit()
         nonlocal free_util
-        free_util = 10_000 / net.rails.links - net.rails.min_max[0]
-        highest = net.quality()
-        for state_neighbor in net.state_neighbours(line_cap, constructive=constructive):
-            highest = _branch(state_neighbor, depth - 1, highest)
+        origin.apply(mov)
+        free_util = 10_000 / origin.rails.links - origin.rails.min_max[0]
+        highest = origin.quality()
+        for move in origin.neighbour_moves(line_cap, constructive):
+            origin.apply(move)
+            highest = _branch(origin, depth - 1, highest)
+            origin.undo()
+        origin.undo()
 
         return highest
 
@@ -120,6 +171,13 @@ def next_free(line_cap: int = 20) -> Heuristic:
             return len(net.lines) < line_cap
         return 0
 
+    def _batch(net: Network, batch: MoveBatch) -> np.ndarray:
+        # New rails always lead to a station with free rails, so this matches _free
+        free = 1 + batch.new + (np.frombuffer(net.free_degree, dtype=np.uint16)
+                                [batch.destination] > 0)
+        return _with_additions(net, batch, 100 * free - batch.duration, line_cap)
+
+    _next_free.batch = _batch
     return _next_free
 
 
@@ -133,4 +191,8 @@ def perfectionist(line_cap: int = 20) -> Heuristic:
             return len(net.lines) < line_cap
         return 0
 
+    def _batch(net: Network, batch: MoveBatch) -> np.ndarray:
+        return _with_additions(net, batch, np.where(batch.new, 100 - batch.duration, 0), line_cap)
+
+    _perfectionist.batch = _batch
     return _perfectionist
@@ -0,0 +1,117 @@
+""" Large neighbourhood search, destroying and repairing whole lines """
+
+from __future__ import annotations
+
+from itertools import pairwise
+from random import sample, randrange
+
+from src.algorithms import acceptance, adjusters, heuristics
+from src.algorithms.generic import Constructive
+from src.classes.abstract import Algorithm
+from src.classes.lines import Network, NetworkState, TrainLine
+from src.classes.moves import RetractionMove, RemovalMove
+
+
+class LargeNeighbourhood(Algorithm):
+    """ Iterative algorithm that removes 'destroy_size' lines each step and
+        rebuilds at most as many with a Constructive algorithm (by default
+        next_free). Repair only extends and trims the rebuilt lines, so the
+        other lines are left as they are.
+        Lines to remove are chosen by the 'destroy' option:
+            'random' -> Any lines
+            'region' -> The lines closest to a random station
+            'worst'  -> Randomly from the lines with the most duration per
+                        rail only they cover
+        Changes are applied through the network journal, so a rejected
+        step (see the 'accept' option and acceptance.py) only reverts the
+        rails it changed. After 'iter_cap' steps, finishes on the best
+        network found                                                      """
+    name = 'ln'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.iter = 0
+        self.iter_cap = options.get('iter_cap', 200)
+        self.line_cap = options.get('line_cap', 7)
+        self.destroy_size = options.get('destroy_size', 2)
+        self.destroy = options.get('destroy', 'random')
+        if self.destroy not in ('random', 'region', 'worst'):
+            raise ValueError("LargeNeighbourhood -> destroy must be"
+                             " one of 'random', 'region' or 'worst'")
+        self.accept = options.get('accept', acceptance.improving())
+        self.builder = Constructive(base, options.get('heur', heuristics.next_free(self.line_cap)),
+                                    options.get('adj', adjusters.soft_n(6)),
+                                    line_cap=self.line_cap, seed=options.get('seed'))
+        self.best = NetworkState.from_network(base)
+
+    def _worst(self, line: TrainLine) -> float:
+        """ The duration of a line per rail only it covers """
+        link_count, lookup = self.active.link_count, self.active.graph.lookup
+        unique = sum(link_count[lookup[stn_a][stn_b]] == 1
+                     for stn_a, stn_b in pairwise(line.stations))
+        return line.duration / unique if unique else float('inf')
+
+    def select(self) -> list[TrainLine]:
+        """ The lines to destroy, according to the destroy option """
+        lines = self.active.lines
+        size = min(self.destroy_size, len(lines))
+        if self.destroy == 'random':
+            return sample(lines, size)
+        if self.destroy == 'region':
+            stations = self.active.graph.stations
+            centre = stations[randrange(len(stations))]
+            return sorted(lines, key=lambda line: min(
+                centre.distance(stations[stn]) for stn in line.stations))[:size]
+        worst = sorted(lines, key=self._worst, reverse=True)
+        return sample(worst[:2 * size], size)
+
+    def remove(self, line: TrainLine):
+        """ Remove a line by retracting it, recording each move in the journal """
+        while len(line.stations) > 1:
+            self.active.apply(RetractionMove(True, line))
+        self.active.apply(RemovalMove(line.location, self.active))
+
+    def repair(self, first: int, slots: int):
+        """ Rebuild lines in the 'slots' freed from location 'first' on with the
+            constructive algorithm, extending only the rebuilt lines, then trim
+            the rebuilt lines. The lines before 'first' are left unchanged    """
+        net = self.active
+        while not net.fully_covered() and not net.expired():
+            rebuilt = range(first, len(net.lines))
+            move = self.builder.next_move(rebuilt, len(rebuilt) < slots)
+            if move is None:
+                break
+            net.apply(move)
+
+        trimmed = True
+        while trimmed:
+            trimmed = False
+            for line in net.lines[first:]:
+                for ret in line.retractions():
+                    if ret.evident():
+                        net.apply(ret)
+                        trimmed = True
+
+    def __next__(self) -> Network:
+        net = self.active
+        if self.iter >= self.iter_cap or not net.lines:
+            return self.finish(self.best)
+
+        current = net.quality()
+        mark = len(net.journal)
+        destroyed = self.select()
+        # Remove the last lines first, so the locations of the others stay valid
+        for line in sorted(destroyed, key=lambda ln: -ln.location):
+            self.remove(line)
+        # The remaining lines keep their order, so rebuilt lines are added after them
+        self.repair(len(net.lines), len(destroyed))
+
+        self.iter += 1
+        if self.accept(current, net.quality(), self.iter / self.iter_cap):
+            # Keep the changes, without a way back
+            del net.journal[mark:]
+            if net.quality() > self.best.score:
+                self.best = NetworkState.from_network(net)
+        else:
+            net.rewind(mark)
+        return net
@@ -0,0 +1,282 @@
+""" Set cover algorithm over a precomputed pool of feasible lines """
+
+from __future__ import annotations
+
+import itertools
+from time import monotonic
+
+import numpy as np
+
+from src.classes.abstract import Algorithm, DeadlineExceeded
+from src.classes.lines import Network
+from src.classes.rails import CompiledRails
+
+# (path index, first station index, last station index) of a line along a pool path
+Section = tuple[int, int, int]
+
+
+class PathPool:
+    """ All simple paths of at most 'dist_cap' minutes that can't be
+        extended at either end, with their rails as bitsets. Any other
+        simple path within the cap is a section of one of these, so
+        the best section of every path is scored instead of all paths  """
+
+    def __init__(self, graph: CompiledRails, dist_cap: int, deadline: float | None = None):
+        """
+        Enumerate the pool of paths (this takes a few seconds on the NL case)
+        :param graph: The compiled infrastructure
+        :param dist_cap: The maximum duration of a path
+        :param deadline: Time (see time.monotonic) at which to raise DeadlineExceeded
+        """
+        self.graph = graph
+        self.dist_cap = dist_cap
+        # Paths as station ids, by the bitset of their rails
+        found: dict[int, tuple[int, ...]] = {}
+        for station in range(len(graph)):
+            self._search([station], {station}, 0, 0, found, deadline)
+        # Longest paths first, so later positions are only held by a prefix of paths
+        order = sorted(found.items(), key=lambda item: -len(item[1]))
+        self.masks: list[int] = [mask for mask, _ in order]
+        self.paths: list[tuple[int, ...]] = [path for _, path in order]
+
+        # The rails of each path by position, padded with a sentinel rail id
+        width = len(self.paths[0]) - 1 if self.paths else 0
+        self.sentinel = len(graph.edge_duration)
+        self.edges = np.full((width, len(self.paths)), self.sentinel,
+                             dtype=np.min_scalar_type(self.sentinel))
+        for index, path in enumerate(self.paths):
+            self.edges[:len(path) - 1, index] = [
+                graph.lookup[stn_a][stn_b] for stn_a, stn_b in itertools.pairwise(path)]
+        # The amount of paths with a rail at each position
+        self.counts = [int(np.count_nonzero(row != self.sentinel)) for row in self.edges]
+
+    @classmethod
+    def get(cls, graph: CompiledRails, dist_cap: int, deadline: float | None = None) -> PathPool:
+        """ The pool for the given infrastructure and cap, enumerated at first
+            use and kept on the infrastructure. An enumeration interrupted by
+            the deadline raises DeadlineExceeded, and is not kept             """
+        if dist_cap not in graph.pools:
+            graph.pools[dist_cap] = cls(graph, dist_cap, deadline)
+        return graph.pools[dist_cap]
+
+    def _closed(self, station: int, visited: set[int], duration: int) -> bool:
+        """ Whether a path can't be extended past 'station' """
+        return all(dest in visited or duration + dist > self.dist_cap
+                   for dest, dist, _ in self.graph.adjacency[station])
+
+    def _search(self, path: list[int], visited: set[int], mask: int,
+                duration: int, found: dict[int, tuple[int, ...]], deadline: float | None):
+        """ Depth-first search for maximal paths extending 'path' at its end """
+        if deadline is not None and monotonic() >= deadline:
+            raise DeadlineExceeded
+        extended = False
+        for dest, dist, edge in self.graph.adjacency[path[-1]]:
+            if dest in visited or duration + dist > self.dist_cap:
+                continue
+            extended = True
+            visited.add(dest)
+            path.append(dest)
+            self._search(path, visited, mask | 1 << edge, duration + dist, found, deadline)
+            path.pop()
+            visited.discard(dest)
+
+        # Each path is found from both ends, only the one with the lower id is kept
+        if not extended and len(path) > 1 and path[0] < path[-1] \
+                and self._closed(path[0], visited, duration):
+            found[mask] = tuple(path)
+
+    def section_values(self, weights: np.ndarray) -> np.ndarray:
+        """ The highest total weight of a section of each path (Kadane's algorithm,
+            for all paths at once), with 'weights' indexed by rail id and sentinel """
+        weights = weights.astype(np.float32)
+        best = np.full(len(self.paths), -np.inf, dtype=np.float32)
+        current = best.copy()
+        row = np.empty_like(best)
+        for edges, count in zip(self.edges, self.counts):
+            np.take(weights, edges[:count], out=row[:count])
+            # Paths past their last rail can't improve, so are skipped
+            cur, new = current[:count], row[:count]
+            cur += new
+            np.maximum(cur, new, out=cur)
+            np.maximum(best[:count], cur, out=best[:count])
+        return best
+
+    def best_section(self, index: int, weights: np.ndarray) -> tuple[Section, float]:
+        """ The highest weight section of a single path, and its weight """
+        best, section = -np.inf, (index, 0, 1)
+        current, start = -np.inf, 0
+        for pos in range(len(self.paths[index]) - 1):
+            weight = weights[self.edges[pos, index]]
+            if current < 0:
+                current, start = weight, pos
+            else:
+                current += weight
+            if current > best:
+                best, section = current, (index, start, pos + 1)
+        return section, best
+
+    def section_mask(self, section: Section) -> int:
+        """ The bitset of the rails of a section """
+        index, first, last = section
+        mask = 0
+        for edge in self.edges[first:last, index]:
+            mask |= 1 << int(edge)
+        return mask
+
+    def stations(self, section: Section) -> tuple[int, ...]:
+        """ The station ids along a section """
+        index, first, last = section
+        return self.paths[index][first:last + 1]
+
+    def __len__(self) -> int:
+        """ The amount of paths in the pool """
+        return len(self.paths)
+
+    def __repr__(self) -> str:
+        """ Represent the pool in a short format """
+        return f'PathPool({len(self.paths)} paths, dist_cap {self.dist_cap})'
+
+
+class SetCover(Algorithm):
+    """ Set cover algorithm over a PathPool: greedily picks the sections
+        adding the most quality, then replaces lines by better sections
+        until none improve. Then 'kicks' times, 'kick_size' random lines
+        are dropped and replaced likewise, keeping no worse results.
+        All lines are added to the network in a single iteration.
+        With the 'choices' option, the first greedy phase picks randomly
+        from that many of the best sections, so repeated runs differ     """
+    name = 'sc'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.line_cap = options.get('line_cap', 7)
+        self.choices = options.get('choices', 1)
+        self.kicks = options.get('kicks', 20)
+        self.kick_size = options.get('kick_size', 3)
+        self.rng = np.random.default_rng(options.get('seed'))
+        # Enumerated at the first iteration, within the deadline of the run
+        self.pool: PathPool | None = None
+
+        edges = len(base.graph.edge_duration)
+        self.bytes = (edges + 7) // 8
+        # Durations by rail id, with the sentinel rail ending every section
+        self.durations = np.append(np.array(base.graph.edge_duration, dtype=float), np.inf)
+        # Quality gained by newly covering each rail id
+        self.values = np.append(np.array(base.graph.edge_value), 0)
+        # Rails already covered by the lines of the base network
+        self.fixed = 0
+        for edge, count in enumerate(base.link_count):
+            if count:
+                self.fixed |= 1 << edge
+        self.budget = self.line_cap - len(base.lines)
+        self.solution: list[Section] | None = None
+
+    def _bits(self, mask: int) -> np.ndarray:
+        """ A bitset of rails as an array of zeros and ones, by rail id """
+        return np.unpackbits(np.frombuffer(mask.to_bytes(self.bytes, 'little'), np.uint8),
+                             count=len(self.values) - 1, bitorder='little')
+
+    def _weights(self, covered: int) -> np.ndarray:
+        """ The quality each rail adds to a line, given the rails already covered """
+        return self.values * np.append(1 - self._bits(covered), 0) - self.durations
+
+    def _best(self, covered: int, choices: int = 1) -> tuple[Section, float] | None:
+        """ The section adding the most quality, or None if none add any """
+        weights = self._weights(covered)
+        values = self.pool.section_values(weights) - 100
+        if choices > 1:
+            top = np.argpartition(values, -choices)[-choices:]
+            top = top[values[top] > 0]
+            if not len(top):
+                return None
+            index = int(self.rng.choice(top))
+        else:
+            index = int(np.argmax(values))
+            if values[index] <= 0:
+                return None
+        section, value = self.pool.best_section(index, weights)
+        return section, value - 100
+
+    def _covered(self, lines: list[tuple[Section, int]]) -> int:
+        """ The rails covered by the base network and the given lines """
+        covered = self.fixed
+        for _, mask in lines:
+            covered |= mask
+        return covered
+
+    def _value(self, lines: list[tuple[Section, int]]) -> float:
+        """ The quality the given lines add to the base network """
+        durations = sum(self.durations[self.pool.edges[first:last, index]].sum()
+                        for (index, first, last), _ in lines)
+        new = self._bits(self._covered(lines) & ~self.fixed)
+        return float(self.values[:-1] @ new) - durations - 100 * len(lines)
+
+    def _fill(self, lines: list[tuple[Section, int]], choices: int = 1):
+        """ Greedily add the best sections until none add quality """
+        while len(lines) < self.budget:
+            pick = self._best(self._covered(lines), choices)
+            if pick is None:
+                break
+            lines.append((pick[0], self.pool.section_mask(pick[0])))
+
+    def _improve(self, lines: list[tuple[Section, int]]):
+        """ Replace lines by better sections (given the other lines) until none improve """
+        improved = True
+        while improved and not self.active.expired():
+            improved = False
+            idx = 0
+            while idx < len(lines):
+                others = self._covered(lines[:idx] + lines[idx + 1:])
+                # The line may be trimmed to its best section, given the others
+                section, current = self.pool.best_section(lines[idx][0][0],
+                                                          self._weights(others))
+                current -= 100
+                pick = self._best(others)
+                if pick is None and current <= 0:
+                    # The line adds nothing the others don't
+                    del lines[idx]
+                    improved = True
+                    continue
+                if pick is not None and pick[1] > current + 1e-9:
+                    section = pick[0]
+                    improved = True
+                lines[idx] = section, self.pool.section_mask(section)
+                idx += 1
+            if len(lines) < self.budget:
+                pick = self._best(self._covered(lines))
+                if pick is not None:
+                    lines.append((pick[0], self.pool.section_mask(pick[0])))
+                    improved = True
+
+    def solve(self) -> list[Section]:
+        """ Choose the sections to add as lines. After the first local optimum,
+            each kick removes random lines, then refills and improves the rest,
+            keeping the result if it is no worse                               """
+        lines: list[tuple[Section, int]] = []
+        self._fill(lines, self.choices)
+        self._improve(lines)
+        best, highest = lines, self._value(lines)
+
+        for _ in range(self.kicks):
+            if self.active.expired() or len(best) < 2:
+                break
+            drop = self.rng.choice(len(best), min(self.kick_size, len(best)), replace=False)
+            lines = [line for idx, line in enumerate(best) if idx not in drop]
+            self._fill(lines)
+            self._improve(lines)
+            value = self._value(lines)
+            if value >= highest:
+                best, highest = lines, value
+        return [section for section, _ in best]
+
+    def __next__(self) -> Network:
+        if self.solution is not None:
+            raise StopIteration
+        self.pool = PathPool.get(self.active.graph, self.active.dist_cap, self.active.deadline)
+        self.solution = self.solve()
+        for section in self.solution:
+            stations = self.pool.stations(section)
+            line = self.active.add_line(stations[0])
+            for stn_a, stn_b in itertools.pairwise(stations):
+                line.extend(stn_a, stn_b)
+        return self.active
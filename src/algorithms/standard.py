@@ -2,13 +2,18 @@
 
 from __future__ import annotations
 
+import math
+from heapq import nlargest
 from math import exp
+from operator import itemgetter
 from random import sample, random, choice, shuffle
 from typing import Generator
 
-from src.classes.abstract import Algorithm
-from src.classes.lines import Network
-from src.classes.moves import ExtensionMove, AdditionMove
+from src.classes.abstract import Algorithm, Move, DeadlineExceeded
+from src.classes.frontier import Frontier
+from src.classes.lines import Network, NetworkState
+from src.classes.moves import ExtensionMove, RetractionMove, AdditionMove
+from src.classes.transposition import TranspositionTable
 
 
 class Random(Algorithm):
@@ -44,6 +49,7 @@ class Greedy(Algorithm):
         self.infra = base.rails
         self.line_cap = options.get('line_cap', 7)
         self.longest_rail = self.infra.min_max[1]
+        self.frontier = Frontier(self.active, lambda _, ext: self._sort_key(ext))
 
     def _sort_key(self, extension: ExtensionMove):
         """
@@ -59,15 +65,14 @@ class Greedy(Algorithm):
         :return: ExtensionMove, or None if there are none remaining
         """
         while True:
-            try:
-                mov = max(self.active.extensions(), key=self._sort_key)
-            except ValueError:
+            mov = self.frontier.pop()
+            if mov is None:
                 if len(self.active.lines) == self.line_cap:
                     return None
                 add = self.select_root()
                 if add is None:
                     return None
-                add.commit()
+                self.frontier.commit(add)
                 continue
 
             return mov
@@ -90,7 +95,7 @@ class Greedy(Algorithm):
         ext = self.next_move()
         if ext is None:
             raise StopIteration
-        ext.commit()
+        self.frontier.commit(ext)
         return self.active
 
 
@@ -112,7 +117,7 @@ class Perfectionist(Greedy):
             if len(self.active.lines) < self.line_cap:
                 add = self.select_root()
                 if add is not None:
-                    add.commit()
+                    self.frontier.commit(add)
                     continue
 
             return None
@@ -127,16 +132,15 @@ class HillClimb(Algorithm):
         super().__init__(base, **options)
         self.line_cap = options.get('line_cap', 7)
 
-    def better_neighbours(self) -> Generator[Network]:
-        """ Yields neighbours that are of higher quality """
-        current = self.active.quality()
-        return (state for state in self.active.state_neighbours(self.line_cap)
-                if state.quality() > current)
+    def better_moves(self) -> Generator[Move]:
+        """ Yields moves to neighbours that are of higher quality """
+        return (move for move in self.active.neighbour_moves(self.line_cap)
+                if move.delta_quality() > 0)
 
     def __next__(self) -> Network:
-        for state_neighbour in self.better_neighbours():
-            self.active = state_neighbour
-            return state_neighbour
+        for move in self.better_moves():
+            move.commit()
+            return self.active
         raise StopIteration
 
 
@@ -145,34 +149,118 @@ class LookAhead(Algorithm):
         highest score achievable with 'depth' further moves  """
     name = 'la'
 
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        # Results are shared across steps, and across runs if given by the Runner
+        self.table: TranspositionTable | None = options.get('table')
+        if self.table is None:
+            self.table = TranspositionTable(options.get('table_size', 200_000))
+        self.table.bind(base.graph)
+
     def __next__(self) -> Network:
         line_cap = self.options.get('line_cap', 7)
-        self.active = max(
-            (state_neighbour for state_neighbour in
-             self.active.state_neighbours(line_cap, stationary=False)),
-            key=self.look_ahead, default=self.active)
+        best, highest = None, -math.inf
+        for move in self.active.neighbour_moves(line_cap):
+            self.active.apply(move)
+            score = self.look_ahead(self.active)
+            self.active.undo()
+            if score > highest:
+                best, highest = move, score
+        if best is not None:
+            best.commit()
 
         return self.active
 
     def look_ahead(self, base: Network, depth: int | None = None) -> float:
         """ Look 'depth' moves ahead (default is the given depth cap),
-            and return the highest score achievable                    """
+            and return the highest score achievable. Moves are applied
+            to and undone on 'base', which is left unchanged            """
         if depth is None:
             depth = self.options.get('depth', 1)
         if not depth:
             return base.quality()
+        if base.expired():
+            raise DeadlineExceeded
+        stored = self.table.lookup(base.key, depth)
+        if stored is not None:
+            return stored
 
+        highest = base.quality()
         line_cap = self.options.get('line_cap', 7)
-        return max(base.quality(), max(
-            (self.look_ahead(state_neighbour, depth - 1)
-             for state_neighbour in
-             base.state_neighbours(line_cap, stationary=False)),
-            default=0))
+        if depth == 1:
+            # Leaves can be scored without being built
+            highest += max(0., max(
+                (move.delta_quality() for move in base.neighbour_moves(line_cap)),
+                default=0.))
+        else:
+            for move in base.neighbour_moves(line_cap):
+                base.apply(move)
+                highest = max(self.look_ahead(base, depth - 1), highest)
+                base.undo()
+        self.table.store(base.key, depth, highest)
+        return highest
+
+
+class BeamSearch(Algorithm):
+    """ Constructive beam search, keeping the 'width' highest quality networks
+        each step, each expanded by its 'expand' best moves (default all).
+        Moves are scored by their change in quality and networks reached
+        twice in a step are kept once (by hash), so only kept networks are
+        built. Stops 'patience' steps after the best network was found       """
+    name = 'bs'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.line_cap = options.get('line_cap', 7)
+        self.width = options.get('width', 8)
+        self.expand = options.get('expand', None)
+        self.patience = options.get('patience', 20)
+        self.beam = [base]
+        self.best = base
+        self.stale = 0
+
+    def candidates(self) -> dict[int, tuple[float, Network, Move]]:
+        """ The highest scoring way to reach each neighbour of the beam, by hash """
+        found = {}
+        for net in self.beam:
+            quality = net.quality()
+            moves = net.neighbour_moves(self.line_cap, constructive=True)
+            if self.expand is not None:
+                moves = nlargest(self.expand, moves, key=lambda mv: mv.delta_quality())
+            for move in moves:
+                score = quality + move.delta_quality()
+                # Only the hash of the neighbour is needed, which is cheap to undo
+                net.apply(move)
+                key = net.key
+                net.undo()
+                if key not in found or score > found[key][0]:
+                    found[key] = score, net, move
+        return found
+
+    def __next__(self) -> Network:
+        found = self.candidates() if self.stale < self.patience else {}
+        if not found:
+            return self.finish(self.best)
+
+        self.beam = []
+        for _, parent, move in nlargest(self.width, found.values(), key=itemgetter(0)):
+            child = parent.copy()
+            move.rebind(child).commit()
+            self.beam.append(child)
+        self.active = self.beam[0]
+        if self.active.quality() > self.best.quality():
+            self.best = self.active
+            self.stale = 0
+        else:
+            self.stale += 1
+        return self.active
 
 
 class SimulatedAnnealing(Algorithm):
     """ Iterative algorithm type implementing simulated annealing,
-        transitions from semi-random to hill-climbing              """
+        transitions from semi-random to hill-climbing.
+        With the 'lazy' option, each iteration draws one random move
+        and commits it only if accepted, instead of scanning all moves """
     name = 'sa'
 
     # Scalar constant influencing how random the algorithm should start off
@@ -183,28 +271,98 @@ class SimulatedAnnealing(Algorithm):
         self.iter = 0
         self.iter_cap = self.options.get('iter_cap', 500)
         self.line_cap = self.options.get('line_cap', 7)
+        self.lazy = self.options.get('lazy', False)
 
     @staticmethod
-    def probability(quality, state_neighbour, temp):
-        """ The probability of a state neighbour being selected,
-            given the current quality and temperature            """
-        return exp(min(state_neighbour.quality() - quality, 0) / temp)
+    def probability(delta: float, temp: float) -> float:
+        """ The probability of a move being selected,
+            given its change in quality and the temperature """
+        return exp(min(delta, 0) / temp)
 
     def temperature(self) -> float:
         """ The current 'temperature' of the algorithm """
         return self.schedule * (1 - self.iter / self.iter_cap)
 
     def __next__(self) -> Network:
-        quality = self.active.quality()
         if self.iter >= self.iter_cap:
             raise StopIteration
         temp = self.temperature()
         self.iter += 1
-        neighbours = list(self.active.state_neighbours(self.line_cap))
-        for state_neighbour in sample(neighbours, len(neighbours)):
-            prob = self.probability(quality, state_neighbour, temp)
-
-            if random() < prob:
-                return state_neighbour
-        state_neighbour = choice(neighbours)
-        return state_neighbour
+        if self.lazy:
+            move = self.active.random_move(self.line_cap)
+            if move is not None and random() < self.probability(move.delta_quality(), temp):
+                move.commit()
+            return self.active
+
+        moves = self.active.neighbour_moves(self.line_cap)
+        for move in sample(moves, len(moves)):
+            if random() < self.probability(move.delta_quality(), temp):
+                move.commit()
+                return self.active
+        choice(moves).commit()
+        return self.active
+
+
+class TabuSearch(Algorithm):
+    """ Iterative algorithm taking the best move each step, even if it lowers
+        quality, while moves changing rails or stations changed in the last
+        'tenure' iterations are forbidden ('tabu'). Tabu moves are allowed
+        anyway if they would beat the best network found (aspiration).
+        After 'iter_cap' iterations, finishes on the best network found     """
+    name = 'ts'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.iter = 0
+        self.iter_cap = self.options.get('iter_cap', 500)
+        self.line_cap = self.options.get('line_cap', 7)
+        self.tenure = self.options.get('tenure', 20)
+        # The last iteration changing a rail or station is tabu, by id
+        self.tabu_edges: dict[int, int] = {}
+        self.tabu_stations: dict[int, int] = {}
+        self.best = NetworkState.from_network(base)
+
+    def touched(self, move: Move) -> tuple[dict[int, int], int]:
+        """ The tabu memory and id of the rail or station a move changes """
+        if isinstance(move, ExtensionMove):
+            return self.tabu_edges, move.edge
+        if isinstance(move, RetractionMove):
+            stations = move.line.stations
+            if move.from_end:
+                last, rem = stations[-1], stations[-2]
+            else:
+                last, rem = stations[0], stations[1]
+            return self.tabu_edges, move.line.graph.lookup[last][rem]
+        if isinstance(move, AdditionMove):
+            return self.tabu_stations, move.root
+        # Removals only remove lines of a single station
+        return self.tabu_stations, self.active.lines[move.location].stations[0]
+
+    def next_move(self) -> Move | None:
+        """ The highest quality move that is not tabu, or beats the best network """
+        quality = self.active.quality()
+        best, highest = None, -math.inf
+        moves = self.active.neighbour_moves(self.line_cap)
+        shuffle(moves)
+        for move in moves:
+            delta = move.delta_quality()
+            if delta <= highest:
+                continue
+            memory, ident = self.touched(move)
+            if memory.get(ident, -1) >= self.iter and quality + delta <= self.best.score:
+                continue
+            best, highest = move, delta
+        return best
+
+    def __next__(self) -> Network:
+        move = self.next_move() if self.iter < self.iter_cap else None
+        if move is None:
+            return self.finish(self.best)
+
+        memory, ident = self.touched(move)
+        move.commit()
+        memory[ident] = self.iter + self.tenure
+        self.iter += 1
+        if self.active.quality() > self.best.score:
+            self.best = NetworkState.from_network(self.active)
+        return self.active
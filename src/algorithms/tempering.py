@@ -0,0 +1,147 @@
+""" Parallel tempering: annealing chains at fixed temperatures, exchanging states """
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing as mp
+import os
+import random
+from math import exp
+
+from src.algorithms.standard import SimulatedAnnealing
+from src.classes.abstract import Algorithm
+from src.classes.lines import Network, NetworkState, CompactState
+from src.classes.rails import Rails, CompiledRails
+
+# The infrastructure, dist_cap and line_cap of a worker process
+_setup: tuple[Rails, int, int] | None = None
+
+# The worker pool kept between instances, by the configuration it was set up for
+_pool: tuple[tuple[CompiledRails, int, int, int], mp.pool.Pool] | None = None
+
+
+def _init_worker(rails: Rails, dist_cap: int, line_cap: int):
+    """ Give a worker process its infrastructure, and its own random state """
+    global _setup
+    _setup = rails, dist_cap, line_cap
+    random.seed()
+
+
+def _worker_pool(rails: Rails, dist_cap: int, line_cap: int, workers: int) -> mp.pool.Pool:
+    """ A pool of 'workers' processes set up for the given configuration, kept
+        between instances, so repeated runs don't each start their own. The
+        pool is replaced for another configuration or modified infrastructure """
+    global _pool
+    key = rails.compile(), dist_cap, line_cap, workers
+    if _pool is not None and _pool[0][0] is key[0] and _pool[0][1:] == key[1:]:
+        return _pool[1]
+    _close_pool()
+    methods = mp.get_all_start_methods()
+    context = mp.get_context('fork' if 'fork' in methods else None)
+    _pool = key, context.Pool(workers, _init_worker, (rails, dist_cap, line_cap))
+    return _pool[1]
+
+
+@atexit.register
+def _close_pool():
+    """ Stop the kept worker pool, if any """
+    global _pool
+    if _pool is not None:
+        _pool[1].terminate()
+        _pool = None
+
+
+def metropolis(net: Network, temperature: float, steps: int, line_cap: int) -> NetworkState:
+    """ Advance a chain by 'steps' random moves at a fixed temperature,
+        returning the best state it passed through                      """
+    best = NetworkState.from_network(net)
+    for _ in range(steps):
+        move = net.random_move(line_cap)
+        if move is None:
+            continue
+        delta = move.delta_quality()
+        if random.random() < SimulatedAnnealing.probability(delta, temperature):
+            move.commit()
+            if delta > 0 and net.quality() > best.score:
+                best = NetworkState.from_network(net)
+    return best
+
+
+def _advance(task: tuple[CompactState, float, int]) -> tuple[CompactState, CompactState]:
+    """ Worker function: advance a chain, returning its final and best state """
+    compact, temperature, steps = task
+    rails, dist_cap, line_cap = _setup
+    net = Network.from_state(NetworkState.from_compact(compact, rails), dist_cap)
+    best = metropolis(net, temperature, steps, line_cap)
+    return NetworkState.from_network(net).compact(), best.compact()
+
+
+class ParallelTempering(Algorithm):
+    """ Replica exchange annealing: 'chains' chains at temperatures spaced
+        geometrically from 't_min' to 't_max' each take 'sweep' random moves
+        per iteration, after which neighbouring chains may exchange states.
+        Chains are advanced in up to 'processes' processes (default one per
+        chain, at most the core count), which are kept between instances.
+        The coldest chain is given as the active network. After 'iter_cap'
+        iterations, finishes on the best network any chain found             """
+    name = 'pt'
+
+    def __init__(self, base: Network, **options):
+        super().__init__(base, **options)
+        self.iter = 0
+        self.iter_cap = options.get('iter_cap', 50)
+        self.line_cap = options.get('line_cap', 7)
+        self.sweep = options.get('sweep', 2_000)
+        chains = options.get('chains', 4)
+        t_min, t_max = options.get('t_min', 1.), options.get('t_max', 20.)
+        ratio = (t_max / t_min) ** (1 / max(chains - 1, 1))
+        self.temperatures = [t_min * ratio ** idx for idx in range(chains)]
+
+        # Chain states by temperature, coldest first
+        self.states = [NetworkState.from_network(base)] * chains
+        self.best = self.states[0]
+        self.exchanges = 0
+
+        self.pool = None
+        workers = min(options.get('processes', chains), os.cpu_count() or 1)
+        # Processes of a worker pool (see Runner) can't start their own
+        if workers > 1 and not mp.current_process().daemon:
+            self.pool = _worker_pool(base.rails, base.dist_cap, self.line_cap, workers)
+
+    def advance(self):
+        """ Advance every chain by a sweep of moves """
+        if self.pool is not None:
+            tasks = [(state.compact(), temp, self.sweep)
+                     for state, temp in zip(self.states, self.temperatures)]
+            results = self.pool.map(_advance, tasks)
+            rails = self.active.rails
+            self.states = [NetworkState.from_compact(final, rails) for final, _ in results]
+            bests = [NetworkState.from_compact(best, rails) for _, best in results]
+        else:
+            bests = []
+            for idx, (state, temp) in enumerate(zip(self.states, self.temperatures)):
+                net = Network.from_state(state, self.active.dist_cap)
+                bests.append(metropolis(net, temp, self.sweep, self.line_cap))
+                self.states[idx] = NetworkState.from_network(net)
+        self.best = max([self.best, *bests], key=lambda state: state.score)
+
+    def exchange(self):
+        """ Offer neighbouring chains (alternately starting from the first
+            or second) to exchange states, accepting like the Metropolis rule """
+        for idx in range(self.iter % 2, len(self.states) - 1, 2):
+            cold, hot = self.states[idx], self.states[idx + 1]
+            beta_cold, beta_hot = 1 / self.temperatures[idx], 1 / self.temperatures[idx + 1]
+            if random.random() < exp(min((beta_cold - beta_hot) * (hot.score - cold.score), 0)):
+                self.states[idx], self.states[idx + 1] = hot, cold
+                self.exchanges += 1
+
+    def __next__(self) -> Network:
+        if self.iter >= self.iter_cap:
+            return self.finish(self.best)
+        self.advance()
+        self.exchange()
+        self.iter += 1
+        deadline = self.active.deadline
+        self.active = Network.from_state(self.states[0], self.active.dist_cap)
+        self.active.deadline = deadline
+        return self.active
@@ -3,9 +3,16 @@
 from __future__ import annotations
 
 from abc import abstractmethod, ABC
-from typing import Protocol, TypeAlias, Callable
+from typing import Protocol, TypeAlias, Callable, Sequence
 
-from src.classes.lines import Network
+import numpy as np
+
+from src.classes.lines import Network, NetworkState, MoveBatch
+
+
+class DeadlineExceeded(Exception):
+    """ Raised by searches that are interrupted by the deadline of their
+        network, possibly leaving moves applied (see Network.rewind)     """
 
 
 class Algorithm(ABC):
@@ -21,6 +28,20 @@ class Algorithm(ABC):
     def __iter__(self):
         return self
 
+    def finish(self, best: Network | NetworkState) -> Network:
+        """ Finish on the best network found: makes it the active network
+            (keeping the deadline), or stops if the active one is as good  """
+        score = best.quality() if isinstance(best, Network) else best.score
+        if self.active.quality() >= score:
+            raise StopIteration
+        deadline = self.active.deadline
+        if isinstance(best, Network):
+            self.active = best
+        else:
+            self.active = Network.from_state(best, self.active.dist_cap)
+        self.active.deadline = deadline
+        return self.active
+
     @abstractmethod
     def __next__(self) -> Network: ...
 
@@ -36,9 +57,26 @@ class Move(Protocol):
     def rebind(self, net: Network) -> Move:
         """ Rebind this move to the given network """
 
+    @abstractmethod
+    def delta_quality(self) -> float:
+        """ The change in network quality committing this move would cause """
+
+    @abstractmethod
+    def inverse(self) -> Move:
+        """ The move undoing this move, if it were committed now """
+
 
 # (CurrentNetwork, NextMove) -> Evaluation
 Heuristic: TypeAlias = Callable[[Network, Move], float]
 
+# (CurrentNetwork, AllConstructiveMoves) -> Evaluations
+# Heuristics may offer this as their 'batch' attribute
+BatchHeuristic: TypeAlias = Callable[[Network, MoveBatch], np.ndarray]
+
+Weights: TypeAlias = Sequence[float] | np.ndarray
+
 # (Evaluations) -> AdjustedEvaluations
-Adjuster: TypeAlias = Callable[[list[float]], list[float]]
+Adjuster: TypeAlias = Callable[[Weights], np.ndarray]
+
+# (CurrentQuality, CandidateQuality, Progress) -> Accept
+Acceptance: TypeAlias = Callable[[float, float, float], bool]
@@ -0,0 +1,113 @@
+""" Provable upper bounds on the quality networks can reach on infrastructure
+
+    Quality is the value of covered rails (10_000 / links each) minus 100 per
+    line and the total duration of the lines. Two relaxations bound it:
+
+    Parity (Chinese postman style): covering every rail worth more than its
+        duration gives the baseline. The lines of a network are trails, so
+        each station of odd degree in the rails they ride is a line end,
+        costing half a line (50). Alternatively its parity can be fixed by
+        riding a rail twice (its duration) or by changing whether a rail is
+        covered (the difference between its value and duration). A fix pairs
+        up stations along a path, so each odd station pays at least half the
+        shortest such path to any other station, or 50 if that is cheaper.
+
+    Capacity: 'line_cap' lines of at most 'dist_cap' minutes each can ride
+        no more than line_cap * dist_cap minutes of rails, so the value is
+        at most that of the best rails filling that time (fractionally)
+"""
+
+from __future__ import annotations
+
+import math
+from heapq import heappush, heappop
+
+from src.classes.rails import Rails, CompiledRails
+
+# Margin for floating point error when comparing qualities to a bound
+EPSILON = 1e-6
+
+
+def _edge_values(graph: CompiledRails) -> list[float]:
+    """ The quality gained by covering each rail exactly once """
+    return [value - duration for value, duration in zip(graph.edge_value, graph.edge_duration)]
+
+
+def _nearest(graph: CompiledRails, source: int, costs: list[float]) -> float:
+    """ The cheapest path (by edge cost) from source to any other station """
+    dist = {source: 0.}
+    queue = [(0., source)]
+    while queue:
+        cost, station = heappop(queue)
+        if station != source:
+            return cost
+        for dest, _, edge in graph.adjacency[station]:
+            new = cost + costs[edge]
+            if new < dist.get(dest, math.inf):
+                dist[dest] = new
+                heappush(queue, (new, dest))
+    return math.inf
+
+
+def parity_bound(graph: CompiledRails) -> float:
+    """ Upper bound on quality from the odd stations of the best rail cover """
+    values = _edge_values(graph)
+    baseline = sum(value for value in values if value > 0)
+
+    # Parity of each station in the baseline cover
+    odd = [False] * len(graph)
+    for edge, value in enumerate(values):
+        if value > 0:
+            odd[graph.edge_origin[edge]] ^= True
+            odd[graph.edge_dest[edge]] ^= True
+
+    # Cheapest way to change the parity of a rail: ride it twice or flip its cover
+    costs = [min(duration, abs(value))
+             for duration, value in zip(graph.edge_duration, values)]
+    penalty = sum(min(50., _nearest(graph, station, costs) / 2)
+                  for station, is_odd in enumerate(odd) if is_odd)
+    # Any network with rails has at least one line
+    return baseline - max(100., penalty)
+
+
+def capacity_bound(graph: CompiledRails, line_cap: int, dist_cap: int) -> float:
+    """ Upper bound on quality from the total time 'line_cap' lines can ride """
+    rails = sorted(((value / duration, value, duration) for value, duration
+                    in zip(_edge_values(graph), graph.edge_duration) if value > 0),
+                   reverse=True)
+    highest = -math.inf
+    for lines in range(1, line_cap + 1):
+        # Fractional knapsack of rails in the available time
+        remaining, value = lines * dist_cap, 0.
+        for ratio, rail_value, duration in rails:
+            if duration >= remaining:
+                value += ratio * remaining
+                break
+            value += rail_value
+            remaining -= duration
+        highest = max(highest, value - 100 * lines)
+    return highest
+
+
+def quality_bound(rails: Rails | CompiledRails, line_cap: int, dist_cap: int) -> float:
+    """
+    An upper bound on the quality of any network on the given infrastructure
+    :param rails: The infrastructure, or its compiled form
+    :param line_cap: The maximum amount of lines
+    :param dist_cap: The maximum duration of any single line
+    :return: A quality no network can exceed (the empty network scores 0)
+    """
+    graph = rails.compile() if isinstance(rails, Rails) else rails
+    key = (line_cap, dist_cap)
+    if key not in graph.bounds:
+        if not graph.links or not line_cap:
+            graph.bounds[key] = 0.
+        else:
+            graph.bounds[key] = max(0., min(parity_bound(graph),
+                                            capacity_bound(graph, line_cap, dist_cap)))
+    return graph.bounds[key]
+
+
+def reaches_bound(score: float, bound: float) -> bool:
+    """ Whether a score is (within floating point error) at the bound """
+    return score >= bound - EPSILON
@@ -0,0 +1,122 @@
+""" Class keeping the best constructive moves of a network at hand """
+
+from __future__ import annotations
+
+from heapq import heappush, heappop
+from random import random
+from typing import TYPE_CHECKING
+
+from src.classes.lines import Network, TrainLine
+from src.classes.moves import ExtensionMove, AdditionMove
+
+if TYPE_CHECKING:
+    from src.classes.abstract import Heuristic, Move
+
+
+class Frontier:
+    """ Priority queue of the constructive moves of a network, keyed by
+        heuristic score. Only the moves at the end that moved are added
+        after a commit: stale entries are checked and re-scored lazily
+        when they reach the top, which is exact as long as scores never
+        increase as the network grows (true for the standard heuristics) """
+
+    def __init__(self, net: Network, heur: Heuristic, line_cap: int | None = None):
+        """
+        Create a frontier of all current constructive moves
+        :param net: The network to construct, which should only be changed through commit()
+        :param heur: The score of moves, higher is better
+        :param line_cap: The maximum amount of lines, or None to exclude additions
+        """
+        self.net = net
+        self.heur = heur
+        self.line_cap = line_cap
+        # Entries of (-score, random tiebreak, move)
+        self.heap: list[tuple[float, float, Move]] = []
+
+        for line in net.lines:
+            self._push_line(line)
+        if line_cap is not None:
+            for station, free in enumerate(net.free_degree):
+                if free:
+                    self._push(AdditionMove(station, net))
+
+    def _push(self, move: Move, score: float | None = None):
+        """ Add a move to the queue, scoring it if needed """
+        if score is None:
+            score = self.heur(self.net, move)
+        heappush(self.heap, (-score, random(), move))
+
+    def _push_line(self, line: TrainLine):
+        """ Add all extensions of a line """
+        for ext in line.extensions():
+            self._push(ext)
+
+    def _current(self, move: Move) -> Move | None:
+        """ The up-to-date form of a queued move, or None if it is no longer possible """
+        if isinstance(move, AdditionMove):
+            if self.net.free_degree[move.root] and len(self.net.lines) < self.line_cap:
+                return move
+            return None
+
+        line = move.line
+        stations = line.stations
+        if move.duration > line.dist_cap - line.duration:
+            return None
+        if len(stations) == 1:
+            back = -1
+        elif stations[0] == stations[-1]:
+            return None
+        elif move.origin == stations[-1]:
+            back = stations[-2]
+        elif move.origin == stations[0]:
+            back = stations[1]
+        else:
+            return None
+        if move.destination == back:
+            return None
+
+        new = not self.net.link_count[move.edge]
+        if new != move.new:
+            return move._replace(new=new)
+        return move
+
+    def pop(self) -> Move | None:
+        """ Remove and return the highest scoring move, or None if there are none """
+        while self.heap:
+            _, _, move = heappop(self.heap)
+            current = self._current(move)
+            if current is None:
+                continue
+            score = self.heur(self.net, current)
+            if not self.heap or score >= -self.heap[0][0]:
+                return current
+            # Score dropped below the next entry, try again later
+            self._push(current, score)
+        return None
+
+    def commit(self, move: Move) -> bool:
+        """ Commit a move on the network, adding the moves it makes possible """
+        if not move.commit():
+            return False
+        if isinstance(move, ExtensionMove):
+            line = move.line
+            if len(line.stations) == 2:
+                # Both ends of the line are new
+                self._push_line(line)
+            elif line.stations[0] != line.stations[-1]:
+                for ext in line.gen_extensions(move.destination, move.origin):
+                    self._push(ext)
+        elif isinstance(move, AdditionMove):
+            self._push_line(self.net.lines[-1])
+            if self.line_cap is not None:
+                # More lines may start from the same root
+                self._push(move)
+        return True
+
+    def __len__(self) -> int:
+        """ The amount of queued entries, including stale ones """
+        return len(self.heap)
+
+    def __repr__(self) -> str:
+        """ Represent the frontier in a short format """
+        return f'Frontier({len(self.heap)} entries)'
@@ -2,12 +2,17 @@
 from __future__ import annotations
 
 import itertools
+import random
+from array import array
 from collections import deque
 from copy import copy
-from typing import Generator, Any, NamedTuple, Iterator, TYPE_CHECKING
+from time import monotonic
+from typing import Generator, Any, NamedTuple, Iterator, Iterable, Sequence, TYPE_CHECKING
+
+import numpy as np
 
 from src.classes.moves import ExtensionMove, RetractionMove, RemovalMove, AdditionMove
-from src.classes.rails import Station, Rails
+from src.classes.rails import Rails, KEY_MASK, mix_key
 
 if TYPE_CHECKING:
     from src.classes.abstract import Move
@@ -16,50 +21,65 @@ if TYPE_CHECKING:
 class TrainLine:
     """ Class representing a train line """
 
-    def __init__(self, root: Station, network: Network, dist_cap: int, location: int):
+    def __init__(self, root: int, network: Network, dist_cap: int, location: int):
         """
         Create a new TrainLine
-        :param root: The origin station of the line
+        :param root: The station id of the origin station of the line
         :param network: The network the line belongs to
         :param dist_cap: The maximum duration of the line
         :param location: The index of the line in the network
         """
-        self.stations: deque[Station] = deque([root])
-        self.rails = network.rails
+        self.stations: deque[int] = deque([root])
+        self.graph = network.graph
         self.network: Network = network
         self.duration = 0
         self.dist_cap = dist_cap
         self.location: int = location
+        # Hash of the line: keys of both ends plus keys of all rails used
+        self.key: int = 2 * self.graph.station_keys[root] & KEY_MASK
 
-    def extend(self, origin: Station, destination: Station, is_new: bool | None = None) -> bool:
+    def extend(self, origin: int, destination: int, is_new: bool | None = None,
+               edge: int | None = None, at_end: bool | None = None) -> bool:
         """
         Add a station to the line
-        :param origin: Station to extend from, must be head or tail of line
-        :param destination: Station to extend to
+        :param origin: Station id to extend from, must be head or tail of line
+        :param destination: Station id to extend to
         :param is_new: If known, whether this extension is new to the network
+        :param edge: If known, the edge id of the rail between origin and destination
+        :param at_end: Whether to extend the tail rather than the head,
+                       for when origin is both (default: prefer the tail)
         :return: False on error
         """
-        if is_new is None:
-            is_new = not self.network.link_count[origin][destination]
-        is_end = origin is self.stations[-1]
-        is_beginning = origin is self.stations[0]
+        is_end = origin == self.stations[-1]
+        is_beginning = origin == self.stations[0]
+        if at_end is not None and is_end and is_beginning:
+            is_end = at_end
         if not is_end and not is_beginning:
             print('Warning: Disconnected train line extension attempted')
             return False
-        try:
-            ex_duration = self.rails[origin][destination]
-        except KeyError:
-            print("Warning: there is no rail between origin and destination")
-            return False
-        self.network.link_count[origin][destination] += 1
-        self.network.link_count[destination][origin] += 1
+        if edge is None:
+            try:
+                edge = self.graph.lookup[origin][destination]
+            except KeyError:
+                print("Warning: there is no rail between origin and destination")
+                return False
+        net = self.network
+        if is_new is None:
+            is_new = not net.link_count[edge]
+        ex_duration = self.graph.edge_duration[edge]
+        net.link_count[edge] += 1
         if is_new:
-            self.network.total_links += 1
-            self.network.free_degree[origin] -= 1
-            self.network.free_degree[destination] -= 1
+            net.total_links += self.graph.edge_links[edge]
+            net.free_degree[origin] -= 1
+            net.free_degree[destination] -= 1
         else:
-            self.network.overtime += ex_duration
+            net.overtime += ex_duration
         self.duration += ex_duration
+        net.duration += ex_duration
+        old_key = self.key
+        self.key = (old_key + self.graph.station_keys[destination]
+                    - self.graph.station_keys[origin] + self.graph.edge_keys[edge]) & KEY_MASK
+        net.key = (net.key + mix_key(self.key) - mix_key(old_key)) & KEY_MASK
         if is_end:
             self.stations.append(destination)
         else:
@@ -76,26 +96,31 @@ class TrainLine:
         removed = self.stations.pop() if from_end else self.stations.popleft()
         remaining = self.stations[-1] if from_end else self.stations[0]
         try:
-            rem_duration = self.rails[remaining][removed]
-            self.network.link_count[remaining][removed] -= 1
-            self.network.link_count[removed][remaining] -= 1
+            edge = self.graph.lookup[remaining][removed]
         except KeyError:
             print("Warning: TrainLine improperly constructed")
             return False
+        net = self.network
+        rem_duration = self.graph.edge_duration[edge]
+        net.link_count[edge] -= 1
         self.duration -= rem_duration
+        net.duration -= rem_duration
+        old_key = self.key
+        self.key = (old_key + self.graph.station_keys[remaining]
+                    - self.graph.station_keys[removed] - self.graph.edge_keys[edge]) & KEY_MASK
+        net.key = (net.key + mix_key(self.key) - mix_key(old_key)) & KEY_MASK
         if is_last is None:
-            is_last = not self.network.link_count[remaining][removed]
+            is_last = not net.link_count[edge]
 
         if is_last:
-            self.network.total_links -= 1
-            self.network.free_degree[remaining] += 1
-            self.network.free_degree[removed] += 1
+            net.total_links -= self.graph.edge_links[edge]
+            net.free_degree[remaining] += 1
+            net.free_degree[removed] += 1
         else:
-            self.network.overtime -= rem_duration
+            net.overtime -= rem_duration
         return True
 
-    def gen_extensions(self, origin: Station,
-                       back: Station | None = None) -> Generator[ExtensionMove]:
+    def gen_extensions(self, origin: int, back: int = -1) -> Generator[ExtensionMove]:
         """
         Generate individual extensions from this line
         :param origin: Either the head or tail of the line
@@ -103,18 +128,18 @@ class TrainLine:
         :return: Yields ExtensionMoves
         """
         remaining_duration = self.dist_cap - self.duration
-        for extension, d_duration in self.rails[origin].items():
-            if d_duration <= remaining_duration and extension is not back:
+        link_count = self.network.link_count
+        for extension, d_duration, edge in self.graph.adjacency[origin]:
+            if d_duration <= remaining_duration and extension != back:
                 yield ExtensionMove(
-                    not self.network.link_count[origin][extension],
-                    d_duration, self, origin, extension)
+                    not link_count[edge], d_duration, self, origin, extension, edge)
 
     def extensions(self) -> Iterator[ExtensionMove]:
         """ Get an iterable of all valid extensions to the line """
         if len(self.stations) == 1:
             return self.gen_extensions(self.stations[-1])
 
-        if self.stations[-1] is self.stations[0]:
+        if self.stations[-1] == self.stations[0]:
             return iter(())
 
         return itertools.chain(
@@ -141,13 +166,15 @@ class TrainLine:
 
     def output(self) -> str:
         """ Turn the train line into the format required for A&H output files """
-        return '"[' + ', '.join(station.name for station in self.stations) + ']"'
+        stations = self.graph.stations
+        return '"[' + ', '.join(stations[stn].name for stn in self.stations) + ']"'
 
     def copy(self, net: Network) -> TrainLine:
         """ Create a copy of this train line, onto the given network """
         new = TrainLine(self.stations[0], net, self.dist_cap, self.location)
         new.stations = copy(self.stations)
         new.duration = self.duration
+        new.key = self.key
         return new
 
 
@@ -161,22 +188,34 @@ class Network:
         :param dist_cap: The maximum runtime of any single line
         """
         self.rails = rails
-        self._dist_cap = dist_cap
+        self.graph = rails.compile()
+        self.dist_cap = dist_cap
         self.lines: list[TrainLine] = []
-        self.link_count: dict[Station, dict[Station, int]] = {}
-        self.free_degree: dict[Station, int] = {}
 
-        for stn_a, stn_conn in rails.connections.items():
-            self.link_count[stn_a] = {stn_b: 0 for stn_b in stn_conn.keys()}
-            self.free_degree[stn_a] = len(stn_conn)
+        # Usage count per edge id, and unused rails per station id,
+        #   kept in flat buffers so copying a network stays cheap
+        self.link_count: array[int] = array('H', bytes(2 * len(self.graph.edge_duration)))
+        self.free_degree: array[int] = array('H', self.graph.degree)
 
         self.total_links = 0
         self.overtime = 0
-
-    def add_line(self, root: Station) -> TrainLine:
-        """ Add a new line, starting from the root station """
-        line = TrainLine(root, self, self._dist_cap, len(self.lines))
+        # Running total of line durations
+        self.duration = 0
+        # Quality gained per newly covered rail
+        self.link_value = 10_000 / self.graph.links
+        # Hash of the network, independent of line order and direction
+        self.key = 0
+
+        # Inverses of the moves applied through apply(), latest last
+        self.journal: list[Move] = []
+        # Time (see time.monotonic) after which searches on this network should stop
+        self.deadline: float | None = None
+
+    def add_line(self, root: int) -> TrainLine:
+        """ Add a new line, starting from the root station id """
+        line = TrainLine(root, self, self.dist_cap, len(self.lines))
         self.lines.append(line)
+        self.key = (self.key + mix_key(line.key)) & KEY_MASK
         return line
 
     def extensions(self) -> Iterator[ExtensionMove]:
@@ -199,7 +238,7 @@ class Network:
     def additions(self) -> Iterator[AdditionMove]:
         """ Get an iterator of all possible line additions """
         return (AdditionMove(station, self) for station, free
-                in self.free_degree.items() if free)
+                in enumerate(self.free_degree) if free)
 
     def moves(self, addition: bool = True) -> Iterator[Move]:
         """ Get an iterator of all possible moves """
@@ -212,12 +251,133 @@ class Network:
             return itertools.chain(standard, self.additions())
         return standard
 
+    def random_move(self, line_cap: int, rng: random.Random | None = None) -> Move | None:
+        """
+        Draw a uniformly random move from moves(), without generating them all:
+        slots for every possible move of every line are drawn until a valid one is hit
+        :param line_cap: The maximum amount of lines, limiting additions
+        :param rng: The random generator to use (default: the random module)
+        :return: A move, or None if there are none
+        """
+        rng = rng or random
+        graph = self.graph
+        max_degree = max(graph.degree, default=0)
+        # Per line: extension slots for both ends, two retractions and a removal
+        line_slots = 2 * max_degree + 3
+        extension_slots = len(self.lines) * line_slots
+        total = extension_slots + (len(graph) if len(self.lines) < line_cap else 0)
+        if not total:
+            return None
+
+        for _ in range(64 * total):
+            slot = int(rng.random() * total)
+            if slot >= extension_slots:
+                station = slot - extension_slots
+                if self.free_degree[station]:
+                    return AdditionMove(station, self)
+                continue
+
+            line = self.lines[slot // line_slots]
+            stations = line.stations
+            slot %= line_slots
+            if slot < 2 * max_degree:
+                at_head, slot = divmod(slot, max_degree)
+                if len(stations) == 1:
+                    if at_head:
+                        continue
+                    origin, back = stations[0], -1
+                elif stations[0] == stations[-1]:
+                    continue
+                elif at_head:
+                    origin, back = stations[0], stations[1]
+                else:
+                    origin, back = stations[-1], stations[-2]
+                if slot >= graph.degree[origin]:
+                    continue
+                dest, duration, edge = graph.adjacency[origin][slot]
+                if dest != back and duration <= line.dist_cap - line.duration:
+                    return ExtensionMove(not self.link_count[edge], duration,
+                                         line, origin, dest, edge)
+            elif slot < line_slots - 1:
+                from_end = slot == line_slots - 2
+                if len(stations) > 2 or (from_end and len(stations) == 2):
+                    return RetractionMove(from_end, line)
+            elif len(stations) == 1:
+                return RemovalMove(line.location, self)
+
+        # Practically unreachable, unless nearly every slot is invalid
+        return rng.choice(self.neighbour_moves(line_cap) or [None])
+
     def constructions(self, addition: bool = True) -> Iterator[Move]:
         """ Get an iterator of all constructive moves """
         if not addition:
             return self.extensions()
         return itertools.chain(self.extensions(), self.additions())
 
+    def batch(self, addition: bool = True) -> MoveBatch:
+        """ Get all constructive moves at once, as arrays """
+        # Per line end: station, previous station, line location, remaining duration
+        ends = []
+        for line in self.lines:
+            stations = line.stations
+            remaining = line.dist_cap - line.duration
+            if len(stations) == 1:
+                ends.append((stations[0], -1, line.location, remaining))
+            elif stations[-1] != stations[0]:
+                ends.append((stations[-1], stations[-2], line.location, remaining))
+                ends.append((stations[0], stations[1], line.location, remaining))
+
+        vec = self.graph.vectors()
+        ends = np.array(ends, dtype='l').reshape(-1, 4).T
+        counts = vec.degree[ends[0]]
+        # Index of every (end, neighbour) pair into the CSR arrays
+        firsts = counts.cumsum() - counts
+        index = np.arange(firsts[-1] + counts[-1] if len(counts) else 0) \
+            + (vec.offsets[ends[0]] - firsts).repeat(counts)
+        ends = ends.repeat(counts, axis=1)
+        duration = vec.durations[index]
+        destination = vec.neighbours[index]
+        valid = (duration <= ends[3]) & (destination != ends[1])
+
+        edge = vec.edge_ids[index[valid]]
+        if addition:
+            roots = np.flatnonzero(np.frombuffer(self.free_degree, dtype=np.uint16))
+        else:
+            roots = np.zeros(0, dtype='l')
+        return MoveBatch(
+            np.frombuffer(self.link_count, dtype=np.uint16)[edge] == 0,
+            duration[valid], ends[2, valid], ends[0, valid],
+            destination[valid], edge, roots, self)
+
+    def neighbour_moves(self, line_cap: int, constructive: bool = False) -> list[Move]:
+        """ All moves to state neighbours of this network,
+            without retractions if constructive is true    """
+        addition = len(self.lines) < line_cap
+        if constructive:
+            return list(self.constructions(addition))
+        return list(self.moves(addition))
+
+    def apply(self, move: Move) -> bool:
+        """ Commit a move bound to this network, recording how to undo it """
+        inverse = move.inverse()
+        if not move.commit():
+            return False
+        self.journal.append(inverse)
+        return True
+
+    def undo(self) -> bool:
+        """ Undo the most recently applied move """
+        return self.journal.pop().commit()
+
+    def rewind(self, mark: int = 0):
+        """ Undo applied moves until only 'mark' remain in the journal """
+        while len(self.journal) > mark:
+            self.journal.pop().commit()
+
+    def expired(self) -> bool:
+        """ Whether the deadline for searching on this network has passed """
+        return self.deadline is not None and monotonic() >= self.deadline
+
     def trim(self):
         """ Remove plainly useless rails (overlaps at ends) """
         act = True
@@ -238,14 +398,15 @@ class Network:
 
     def total_duration(self) -> int:
         """ Total duration of lines in the network """
-        return sum(line.duration for line in self.lines)
+        return self.duration
 
     def quality(self) -> float:
         """
         Quality score, as given by the case description:
             Q = coverage * 10_000 - (lines * 100 + total_duration)
         """
-        return self.coverage() * 10_000 - (len(self.lines) * 100 + self.total_duration())
+        return self.total_links / self.graph.links * 10_000 \
+            - (len(self.lines) * 100 + self.duration)
 
     def is_optimal(self) -> bool:
         """ Whether this network, given a constant rail count, is optimal """
@@ -276,16 +437,31 @@ class Network:
         return 'train,stations\n' + ''.join(line_outputs) + f'score,{self.quality()}'
 
     @classmethod
-    def from_state(cls, state: NetworkState):
+    def from_state(cls, state: NetworkState, dist_cap: int = 120):
         """ Create a Network from a NetworkState """
-        net = cls(state.infra)
-        for out_line in state.lines:
+        return cls.from_lines(state.lines, state.infra, dist_cap)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[Sequence[int]], infra: Rails,
+                   dist_cap: int = 120) -> Network:
+        """ Create a Network from lines of station ids """
+        net = cls(infra, dist_cap)
+        for out_line in lines:
             net_line = net.add_line(out_line[0])
             for s_a, s_b in itertools.pairwise(out_line):
                 net_line.extend(s_a, s_b)
 
         return net
 
+    def expand(self) -> Network:
+        """ The equivalent network on the uncontracted infrastructure
+            (see Rails.contract), or this network if not contracted  """
+        if self.rails.uncontracted is None:
+            return self
+        net = Network.from_state(NetworkState.from_network(self).expand(), self.dist_cap)
+        net.deadline = self.deadline
+        return net
+
     @classmethod
     def from_output(cls, out: str, infra: Rails) -> Network:
         """ Create a Network from an output string, on given infrastructure """
@@ -293,14 +469,15 @@ class Network:
 
     def copy(self) -> Network:
         """ Create a copy of this network """
-        net = Network(self.rails, self._dist_cap)
+        net = Network(self.rails, self.dist_cap)
         net.lines = [line.copy(net) for line in self.lines]
-        net.link_count = {
-            stn_a: copy(stn_conn)
-            for stn_a, stn_conn in self.link_count.items()
-        }
+        net.link_count = self.link_count[:]
+        net.free_degree = self.free_degree[:]
         net.total_links = self.total_links
         net.overtime = self.overtime
+        net.duration = self.duration
+        net.key = self.key
+        net.deadline = self.deadline
         return net
 
     def pivot(self) -> Generator[Network]:
@@ -313,12 +490,7 @@ class Network:
         """ Yield all state neighbours from this network, including
             this network if stationary is True,
             without retractions if constructive is true             """
-        addition = len(self.lines) < line_cap
-        if not constructive:
-            moves = self.moves(addition)
-        else:
-            moves = self.constructions(addition)
-        for move, net in zip(moves, self.pivot()):
+        for move, net in zip(self.neighbour_moves(line_cap, constructive), self.pivot()):
             move.rebind(net).commit()
             net.move = move
             yield net
@@ -326,54 +498,131 @@ class Network:
             yield self.copy()
 
 
+class MoveBatch(NamedTuple):
+    """ All constructive moves of a network as arrays: extensions
+        (one entry per array), followed by additions (one per root) """
+    new: np.ndarray
+    duration: np.ndarray
+    line: np.ndarray
+    origin: np.ndarray
+    destination: np.ndarray
+    edge: np.ndarray
+    roots: np.ndarray
+    network: Network
+
+    def extensions(self) -> int:
+        """ The amount of extensions in the batch """
+        return len(self.new)
+
+    def only(self, lines: Iterable[int]) -> MoveBatch:
+        """ The batch without the extensions of lines (by location) not given """
+        keep = np.isin(self.line, np.fromiter(lines, dtype='l'))
+        return MoveBatch(self.new[keep], self.duration[keep], self.line[keep], self.origin[keep],
+                         self.destination[keep], self.edge[keep], self.roots, self.network)
+
+    def move(self, index: int) -> Move:
+        """ Create the move at 'index', counting extensions before additions """
+        if index < len(self.new):
+            return ExtensionMove(
+                bool(self.new[index]), int(self.duration[index]),
+                self.network.lines[self.line[index]], int(self.origin[index]),
+                int(self.destination[index]), int(self.edge[index]))
+        return AdditionMove(int(self.roots[index - len(self.new)]), self.network)
+
+    def __len__(self) -> int:
+        """ The amount of moves in the batch """
+        return len(self.new) + len(self.roots)
+
+    def __repr__(self) -> str:
+        """ Represent the batch in a short format """
+        return f'MoveBatch({len(self.new)} extensions, {len(self.roots)} additions)'
+
+
+# Lines, score and hash of a NetworkState, see NetworkState.compact
+CompactState = tuple[tuple[tuple[int, ...], ...], float, int]
+
+
 class NetworkState(NamedTuple):
-    """ A class compactly representing a single state of a network """
-    lines: tuple[tuple[Station, ...], ...]
+    """ A class compactly representing a single state of a network,
+        with lines given as tuples of station ids. States are hashed by
+        the network hash, and compared by it before their lines        """
+    lines: tuple[tuple[int, ...], ...]
     infra: Rails
     score: float
+    key: int
 
     @classmethod
     def from_network(cls, net: Network) -> NetworkState:
         """ Create a NetworkState from a network """
-        return cls(tuple(tuple(line.stations) for line in net.lines), net.rails, net.quality())
+        return cls(tuple(tuple(line.stations) for line in net.lines),
+                   net.rails, net.quality(), net.key)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[Sequence[int]], infra: Rails,
+                   score: float) -> NetworkState:
+        """ Create a NetworkState from lines of station ids, computing its hash """
+        graph = infra.compile()
+        lines = tuple(tuple(line) for line in lines)
+        key = sum(mix_key(graph.line_key(line)) for line in lines) & KEY_MASK
+        return cls(lines, infra, score, key)
 
     @classmethod
     def from_output(cls, output: str, infra: Rails) -> NetworkState:
         """ Create a NetworkState from an output string and on given infrastructure """
-        return cls(tuple(
-            tuple(infra.names[name] for name in line) for line in
+        ids = infra.compile().ids
+        return cls.from_lines((
+            tuple(ids[infra.names[name]] for name in line) for line in
             (line.split('"')[1][1:-1].split(', ') for line in output.split('\n')[1:-1])
         ), infra, float(output.split('score,')[1]))
 
+    @classmethod
+    def from_compact(cls, compact: CompactState, infra: Rails) -> NetworkState:
+        """ Create a NetworkState from its compact form, on given infrastructure """
+        lines, score, key = compact
+        return cls(lines, infra, score, key)
+
+    def expand(self) -> NetworkState:
+        """ The equivalent state on the uncontracted infrastructure
+            (see Rails.contract), or this state if not contracted  """
+        infra = self.infra.uncontracted
+        if infra is None:
+            return self
+        stations, ids = self.infra.compile().stations, infra.compile().ids
+        return NetworkState.from_lines((
+            [ids[stn] for stn in self.infra.expand([stations[stn] for stn in line])]
+            for line in self.lines), infra, self.score)
+
+    def compact(self) -> CompactState:
+        """ This state without its infrastructure, to send between processes """
+        return self.lines, self.score, self.key
+
+    def canonical(self) -> NetworkState:
+        """ The equivalent state with each line in its lowest direction
+            and the lines in sorted order                                """
+        return self._replace(lines=tuple(sorted(
+            min(line, line[::-1]) for line in self.lines)))
+
     def __repr__(self) -> str:
         """ Represent a NetworkState in a short format """
         return f"NetworkState({len(self.lines)} line{'' if len(self.lines) == 1 else 's'})"
 
     def __eq__(self, other: NetworkState | Any):
-        """ Whether two NetworkStates are equivalent """
+        """ Whether two NetworkStates are equivalent, up to the order and
+            direction of their lines. The hash rules out most unequal states,
+            but lines with the same ends and rails hash alike in any order,
+            so states with equal hashes are compared in canonical form      """
         if not isinstance(other, NetworkState):
             return False
+        return self.key == other.key and self.infra is other.infra \
+            and self.canonical().lines == other.canonical().lines
 
-        if self.infra is not other.infra or len(self.lines) != len(other.lines):
-            return False
-
-        indices = list(range(len(self.lines)))
-
-        for line in self.lines:
-            equiv = False
-            for i in indices:
-                if line == other.lines[i] or line == tuple(reversed(other.lines[i])):
-                    indices.remove(i)
-                    equiv = True
-                    break
-            if not equiv:
-                return False
-
-        return not indices
+    def __hash__(self) -> int:
+        """ The network hash of the state """
+        return self.key
 
 
 if __name__ == '__main__':
     r = Rails()
     r.load('data/positions.csv', 'data/connections.csv')
     n = Network(r)
-    line0 = n.add_line(r.stations[0])
+    line0 = n.add_line(n.graph.ids[r.stations[0]])
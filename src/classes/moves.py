@@ -4,10 +4,11 @@ from __future__ import annotations
 
 from typing import NamedTuple, TYPE_CHECKING
 
+from src.classes.rails import KEY_MASK, mix_key
+
 if TYPE_CHECKING:
     # Prevent import loop
     from src.classes.lines import Network, TrainLine
-    from src.classes.rails import Station
 
 
 class ExtensionMove(NamedTuple):
@@ -15,17 +16,30 @@ class ExtensionMove(NamedTuple):
     new: bool
     duration: int
     line: TrainLine
-    origin: Station
-    destination: Station
+    origin: int
+    destination: int
+    edge: int
+    # Whether to extend the tail of the line, if ambiguous by origin alone
+    at_end: bool | None = None
 
     def commit(self) -> bool:
         """ Confirm this extension, adding the destination to the line """
-        return self.line.extend(self.origin, self.destination, self.new)
+        return self.line.extend(self.origin, self.destination, self.new, self.edge, self.at_end)
 
     def rebind(self, net: Network) -> ExtensionMove:
         """ Rebind this extension to the corresponding line in 'net' """
         return self._replace(line=net.lines[self.line.location])
 
+    def delta_quality(self) -> float:
+        """ The change in network quality this extension would cause """
+        if self.new:
+            return self.line.graph.edge_value[self.edge] - self.duration
+        return -self.duration
+
+    def inverse(self) -> RetractionMove:
+        """ The move undoing this extension, if it were committed now """
+        return RetractionMove(self.origin == self.line.stations[-1], self.line)
+
 
 class RetractionMove(NamedTuple):
     """ Represents a retraction of one vertex to a train line """
@@ -40,13 +54,36 @@ class RetractionMove(NamedTuple):
         """ Rebind this retraction to the corresponding line in 'net' """
         return self._replace(line=net.lines[self.line.location])
 
+    def delta_quality(self) -> float:
+        """ The change in network quality this retraction would cause """
+        if self.from_end:
+            last, rem = self.line.stations[-1], self.line.stations[-2]
+        else:
+            last, rem = self.line.stations[0], self.line.stations[1]
+        edge = self.line.graph.lookup[last][rem]
+        if self.line.network.link_count[edge] == 1:
+            return self.line.graph.edge_duration[edge] - self.line.graph.edge_value[edge]
+        return self.line.graph.edge_duration[edge]
+
+    def inverse(self) -> ExtensionMove:
+        """ The move undoing this retraction, if it were committed now """
+        if self.from_end:
+            removed, remaining = self.line.stations[-1], self.line.stations[-2]
+        else:
+            removed, remaining = self.line.stations[0], self.line.stations[1]
+        edge = self.line.graph.lookup[remaining][removed]
+        return ExtensionMove(self.line.network.link_count[edge] == 1,
+                             self.line.graph.edge_duration[edge],
+                             self.line, remaining, removed, edge, self.from_end)
+
     def evident(self) -> bool:
         """ Checks whether this retraction is a retraction over an overlap """
         if self.from_end:
             last, rem = self.line.stations[-1], self.line.stations[-2]
         else:
             last, rem = self.line.stations[0], self.line.stations[1]
-        return bool(self.line.network.link_count[last][rem] - 1)
+        edge = self.line.graph.lookup[last][rem]
+        return bool(self.line.network.link_count[edge] - 1)
 
 
 class RemovalMove(NamedTuple):
@@ -56,7 +93,8 @@ class RemovalMove(NamedTuple):
 
     def commit(self) -> bool:
         """ Confirm this removal, removing a line from the network """
-        del self.network.lines[self.location]
+        removed = self.network.lines.pop(self.location)
+        self.network.key = (self.network.key - mix_key(removed.key)) & KEY_MASK
         for line in self.network.lines[self.location:]:
             line.location -= 1
         return True
@@ -65,10 +103,19 @@ class RemovalMove(NamedTuple):
         """ Rebind this removal to a different network """
         return self._replace(network=net)
 
+    @staticmethod
+    def delta_quality() -> float:
+        """ The change in network quality this removal would cause """
+        return 100
+
+    def inverse(self) -> RestorationMove:
+        """ The move undoing this removal, if it were committed now """
+        return RestorationMove(self.network.lines[self.location], self.network)
+
 
 class AdditionMove(NamedTuple):
     """ Represents an addition of a train line """
-    root: Station
+    root: int
     network: Network
 
     def commit(self) -> bool:
@@ -80,11 +127,47 @@ class AdditionMove(NamedTuple):
         """ Rebind this addition to a different network """
         return self._replace(network=net)
 
+    @staticmethod
+    def delta_quality() -> float:
+        """ The change in network quality this addition would cause """
+        return -100
+
+    def inverse(self) -> RemovalMove:
+        """ The move undoing this addition, if it were committed now """
+        return RemovalMove(len(self.network.lines), self.network)
+
     def degree(self) -> int:
         """ The amount of free connections the root of this addition has """
         return self.network.free_degree[self.root]
 
 
+class RestorationMove(NamedTuple):
+    """ Represents the return of a removed train line to its old location,
+        only used to undo removals                                         """
+    line: TrainLine
+    network: Network
+
+    def commit(self) -> bool:
+        """ Confirm this restoration, inserting the line back into the network """
+        self.network.lines.insert(self.line.location, self.line)
+        self.network.key = (self.network.key + mix_key(self.line.key)) & KEY_MASK
+        for line in self.network.lines[self.line.location + 1:]:
+            line.location += 1
+        return True
+
+    def rebind(self, net: Network) -> RestorationMove:
+        """ Rebind this restoration to a different network """
+        return self._replace(network=net)
+
+    def delta_quality(self) -> float:
+        """ The change in network quality this restoration would cause """
+        return -100 - self.line.duration
+
+    def inverse(self) -> RemovalMove:
+        """ The move undoing this restoration, if it were committed now """
+        return RemovalMove(self.line.location, self.network)
+
+
 if TYPE_CHECKING:
     # Pylint doesn't see NamedTuple._replace
     # See: https://github.com/pylint-dev/pylint/issues/4070
@@ -96,3 +179,4 @@ if TYPE_CHECKING:
     RetractionMove._replace = _replace
     RemovalMove._replace = _replace
     AdditionMove._replace = _replace
+    RestorationMove._replace = _replace
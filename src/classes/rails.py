@@ -2,9 +2,13 @@
 
 from __future__ import annotations
 
+import itertools
 import math
 import random
-from typing import NamedTuple, Generator, Literal
+from array import array
+from typing import NamedTuple, Generator, Literal, Iterable, Sequence
+
+import numpy as np
 
 
 class Station(NamedTuple):
@@ -22,6 +26,38 @@ class Station(NamedTuple):
         return math.sqrt((self.N - other.N) ** 2 + (self.E - other.E) ** 2)
 
 
+# Hash keys are kept to 64 bits
+KEY_MASK = (1 << 64) - 1
+
+
+def mix_key(key: int) -> int:
+    """ Scramble a 64-bit key (splitmix64 finaliser), so that
+        sums of scrambled keys don't cancel out like plain sums  """
+    key = (key ^ (key >> 30)) * 0xBF58476D1CE4E5B9 & KEY_MASK
+    key = (key ^ (key >> 27)) * 0x94D049BB133111EB & KEY_MASK
+    return key ^ (key >> 31)
+
+
+class RailVectors(NamedTuple):
+    """ NumPy views of the CSR arrays of a compiled rail network """
+    offsets: np.ndarray
+    neighbours: np.ndarray
+    durations: np.ndarray
+    edge_ids: np.ndarray
+    degree: np.ndarray
+    edge_duration: np.ndarray
+
+
+class RailStructure(NamedTuple):
+    """ Dead ends and chains of a compiled rail network, see CompiledRails.structure """
+    # Edge ids of the rails whose removal would disconnect the network
+    bridges: frozenset[int]
+    # Station ids of degree one
+    leaves: tuple[int, ...]
+    # Maximal paths of station ids whose inner stations (at least one) have degree two
+    chains: tuple[tuple[int, ...], ...]
+
+
 class RailModification(NamedTuple):
     """ Wrapper for a modification to the rail network """
     type: Literal['move_rail'] | Literal['drop_rail'] \
@@ -30,6 +66,285 @@ class RailModification(NamedTuple):
     dest: Station | None = None
 
 
+class CompiledRails:
+    """ Integer-indexed form of a rail network, stations and rails
+        are numbered densely and adjacency is stored CSR-style       """
+
+    def __init__(self, rails: Rails):
+        """
+        Compile the rail network into arrays
+        :param rails: The infrastructure to compile
+        """
+        self.rails = rails
+        self.stations: tuple[Station, ...] = tuple(rails.connections.keys())
+        self.ids: dict[Station, int] = {stn: i for i, stn in enumerate(self.stations)}
+        self.links = rails.links
+        self.min_max = rails.min_max
+
+        # CSR adjacency: the neighbours of station s are found
+        #   at offsets[s] up to (excluding) offsets[s + 1]
+        #   (None on patched networks until vectors() is asked for)
+        self.offsets: array | None = array('l', [0])
+        self.neighbours: array | None = array('l')
+        self.durations: array | None = array('l')
+        self.edge_ids: array | None = array('l')
+
+        # Per-rail endpoints and durations, indexed by edge id
+        self.edge_origin = array('l')
+        self.edge_dest = array('l')
+        self.edge_duration = array('l')
+        # Per-rail amount of original rails, more than one for the
+        #   chains of a contracted network (see Rails.contract)
+        self.edge_links = array('l')
+
+        edges: dict[tuple[int, int], int] = {}
+        for stn_a, conn in rails.connections.items():
+            id_a = self.ids[stn_a]
+            for stn_b, duration in conn.items():
+                id_b = self.ids[stn_b]
+                key = (id_a, id_b) if id_a < id_b else (id_b, id_a)
+                if key not in edges:
+                    edges[key] = len(self.edge_duration)
+                    self.edge_origin.append(key[0])
+                    self.edge_dest.append(key[1])
+                    self.edge_duration.append(duration)
+                    self.edge_links.append(
+                        len(rails.chains.get((stn_a, stn_b), (stn_a, stn_b))) - 1)
+                self.neighbours.append(id_b)
+                self.durations.append(duration)
+                self.edge_ids.append(edges[key])
+            self.offsets.append(len(self.neighbours))
+
+        # Tuple views of the arrays above, as indexing tuples
+        #   is faster than indexing arrays on Python hot paths
+        self.adjacency: tuple[tuple[tuple[int, int, int], ...], ...] = tuple(
+            tuple(zip(self.neighbours[start:stop],
+                      self.durations[start:stop],
+                      self.edge_ids[start:stop]))
+            for start, stop in zip(self.offsets, self.offsets[1:])
+        )
+        self.lookup: tuple[dict[int, int], ...] = tuple(
+            {dest: edge for dest, _, edge in adj} for adj in self.adjacency
+        )
+        self.degree: tuple[int, ...] = tuple(len(adj) for adj in self.adjacency)
+        # Quality gained by newly covering each rail
+        self.edge_value: tuple[float, ...] = tuple(
+            10_000 * links / self.links if self.links else 0. for links in self.edge_links)
+
+        # Random keys for Zobrist-style hashing of networks, seeded so
+        #   that identical infrastructure gives identical hashes anywhere
+        keygen = random.Random(len(self.stations) * 1_000_003 + len(self.edge_duration))
+        self.station_keys: tuple[int, ...] = tuple(
+            keygen.getrandbits(64) for _ in self.stations)
+        self.edge_keys: tuple[int, ...] = tuple(
+            keygen.getrandbits(64) for _ in self.edge_duration)
+        self._vectors: RailVectors | None = None
+        # Quality bounds by (line_cap, dist_cap), see bounds.quality_bound
+        self.bounds: dict[tuple[int, int], float] = {}
+        # Path pools by dist_cap, see algorithms.pool.PathPool
+        self.pools: dict[int, object] = {}
+        self._structure: RailStructure | None = None
+
+    @classmethod
+    def patched(cls, base: CompiledRails, rails: RailsOverlay) -> CompiledRails:
+        """
+        Compile a variant of a network by patching the compiled base, so that
+        only stations next to modified rails are rebuilt. Stations keep their
+        ids (dropped stations stay, without rails), removed rails make way for
+        the last rail of the base and added rails are numbered after the rest.
+        Per-rail values are only recomputed if the amount of links changed,
+        and the CSR arrays are only built when vectors() is first asked for
+        :param base: The compiled form of the base of the variant
+        :param rails: The variant
+        :return: The compiled variant, hashing like the base where unmodified
+        """
+        new = cls.__new__(cls)
+        new.rails = rails
+        new.stations, new.ids = base.stations, base.ids
+        new.links, new.min_max = rails.links, rails.min_max
+        new.edge_origin, new.edge_dest = base.edge_origin[:], base.edge_dest[:]
+        new.edge_duration, new.edge_links = base.edge_duration[:], base.edge_links[:]
+        edge_keys, edge_value = list(base.edge_keys), list(base.edge_value)
+        ids = base.ids
+
+        # Remove rails from the highest id down, so the last rail is never a removed one
+        gone = sorted({base.lookup[ids[stn]][ids[dest]]
+                       for stn, removed in rails.removed.items() for dest in removed},
+                      reverse=True)
+        # New ids of moved rails by base id, and base ids of moved rails by new id
+        moved: dict[int, int] = {}
+        held: dict[int, int] = {}
+        touched: set[int] = set()
+        for edge in gone:
+            last = len(new.edge_duration) - 1
+            touched.update((new.edge_origin[edge], new.edge_dest[edge]))
+            if edge != last:
+                for values in (new.edge_origin, new.edge_dest, new.edge_duration,
+                               new.edge_links, edge_keys, edge_value):
+                    values[edge] = values[last]
+                touched.update((new.edge_origin[last], new.edge_dest[last]))
+                held[edge] = held.pop(last, last)
+                moved[held[edge]] = edge
+            for values in (new.edge_origin, new.edge_dest, new.edge_duration,
+                           new.edge_links, edge_keys, edge_value):
+                values.pop()
+        gone = set(gone)
+
+        # Added rails, as (neighbour, duration, edge id) per station id
+        extra: dict[int, list[tuple[int, int, int]]] = {}
+        keygen = random.Random(base.station_keys[0] if base.station_keys else 0)
+        for stn, added in rails.added.items():
+            for dest, duration in added.items():
+                id_a, id_b = ids[stn], ids[dest]
+                if id_a > id_b:
+                    continue
+                edge = len(new.edge_duration)
+                new.edge_origin.append(id_a)
+                new.edge_dest.append(id_b)
+                new.edge_duration.append(duration)
+                new.edge_links.append(1)
+                edge_keys.append(keygen.getrandbits(64))
+                edge_value.append(10_000 / new.links)
+                extra.setdefault(id_a, []).append((id_b, duration, edge))
+                extra.setdefault(id_b, []).append((id_a, duration, edge))
+                touched.update((id_a, id_b))
+
+        adjacency = list(base.adjacency)
+        lookup = list(base.lookup)
+        degree = list(base.degree)
+        for station in touched:
+            adjacency[station] = tuple(
+                [(dest, duration, moved.get(edge, edge))
+                 for dest, duration, edge in base.adjacency[station] if edge not in gone]
+                + extra.get(station, []))
+            lookup[station] = {dest: edge for dest, _, edge in adjacency[station]}
+            degree[station] = len(adjacency[station])
+        new.adjacency, new.lookup, new.degree = tuple(adjacency), tuple(lookup), tuple(degree)
+        new.offsets = new.neighbours = new.durations = new.edge_ids = None
+
+        if new.links != base.links:
+            # The value of each rail is its share of all links
+            edge_value = [10_000 * links / new.links if new.links else 0.
+                          for links in new.edge_links]
+        new.edge_value = tuple(edge_value)
+        new.station_keys, new.edge_keys = base.station_keys, tuple(edge_keys)
+        new._vectors = None
+        new.bounds = {}
+        new.pools = {}
+        new._structure = None
+        return new
+
+    def vectors(self) -> RailVectors:
+        """ NumPy views of the CSR arrays, for vectorised move generation """
+        if self._vectors is None:
+            if self.offsets is None:
+                self._build_csr()
+            self._vectors = RailVectors(
+                np.frombuffer(self.offsets, dtype='l'),
+                np.frombuffer(self.neighbours, dtype='l'),
+                np.frombuffer(self.durations, dtype='l'),
+                np.frombuffer(self.edge_ids, dtype='l'),
+                np.array(self.degree, dtype='l'),
+                np.frombuffer(self.edge_duration, dtype='l'))
+        return self._vectors
+
+    def _build_csr(self):
+        """ Build the CSR arrays from the adjacency, for patched networks """
+        self.offsets = array('l', [0])
+        self.offsets.extend(itertools.accumulate(self.degree))
+        self.neighbours = array('l', [dest for adj in self.adjacency for dest, _, _ in adj])
+        self.durations = array('l', [dist for adj in self.adjacency for _, dist, _ in adj])
+        self.edge_ids = array('l', [edge for adj in self.adjacency for _, _, edge in adj])
+
+    def structure(self) -> RailStructure:
+        """ The bridges, leaves and chains of the network, found at first use """
+        if self._structure is None:
+            self._structure = RailStructure(
+                self._bridges(),
+                tuple(stn for stn, degree in enumerate(self.degree) if degree == 1),
+                self._chains())
+        return self._structure
+
+    def _bridges(self) -> frozenset[int]:
+        """ Find the bridges with Tarjan's algorithm, without recursion """
+        order = [-1] * len(self.stations)
+        low = [0] * len(self.stations)
+        bridges = set()
+        counter = 0
+        for root in range(len(self.stations)):
+            if order[root] != -1:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            # (station, edge id it was reached by, its remaining neighbours)
+            stack = [(root, -1, iter(self.adjacency[root]))]
+            while stack:
+                station, via, neighbours = stack[-1]
+                for dest, _, edge in neighbours:
+                    if edge == via:
+                        continue
+                    if order[dest] == -1:
+                        order[dest] = low[dest] = counter
+                        counter += 1
+                        stack.append((dest, edge, iter(self.adjacency[dest])))
+                        break
+                    low[station] = min(low[station], order[dest])
+                else:
+                    stack.pop()
+                    if stack:
+                        parent = stack[-1][0]
+                        low[parent] = min(low[parent], low[station])
+                        if low[station] > order[parent]:
+                            bridges.add(via)
+        return frozenset(bridges)
+
+    def _chains(self) -> tuple[tuple[int, ...], ...]:
+        """ Walk from every station not of degree two through its neighbours
+            of degree two, until reaching another such station               """
+        seen: set[int] = set()
+        chains = []
+        for start, degree in enumerate(self.degree):
+            if degree == 2:
+                continue
+            for station, _, edge in self.adjacency[start]:
+                if edge in seen or self.degree[station] != 2:
+                    continue
+                seen.add(edge)
+                chain = [start]
+                while self.degree[station] == 2:
+                    chain.append(station)
+                    (dest_a, _, edge_a), (dest_b, _, edge_b) = self.adjacency[station]
+                    station, edge = (dest_b, edge_b) if edge_a == edge else (dest_a, edge_a)
+                    seen.add(edge)
+                chain.append(station)
+                chains.append(tuple(chain))
+        return tuple(chains)
+
+    def edge(self, origin: int, dest: int) -> int:
+        """ The edge id of the rail between two station ids """
+        return self.lookup[origin][dest]
+
+    def line_key(self, stations: Sequence[int]) -> int:
+        """ The hash key of a line through the given station ids,
+            which is the same for the line and its reverse        """
+        key = self.station_keys[stations[0]] + self.station_keys[stations[-1]]
+        for stn_a, stn_b in itertools.pairwise(stations):
+            key += self.edge_keys[self.lookup[stn_a][stn_b]]
+        return key & KEY_MASK
+
+    def station_ids(self, stations: Iterable[Station]) -> list[int]:
+        """ Translate stations to their ids """
+        return [self.ids[stn] for stn in stations]
+
+    def __len__(self) -> int:
+        """ The amount of stations in the compiled network """
+        return len(self.stations)
+
+    def __repr__(self) -> str:
+        """ Return a short string summary of the compiled network """
+        return f'CompiledRails({len(self.stations)} stations, {len(self.edge_duration)} rails)'
+
+
 class Rails:
     """ Class representing the full rail network """
 
@@ -46,6 +361,18 @@ class Rails:
 
         self.speed: float = -1
         self.modifications: list[RailModification] = []
+        # Full station paths of the connections that replace chains, by both
+        #   directions, and the network they were contracted from (see contract)
+        self.chains: dict[tuple[Station, Station], tuple[Station, ...]] = {}
+        self.uncontracted: Rails | None = None
+        self._compiled: CompiledRails | None = None
+
+    def compile(self) -> CompiledRails:
+        """ Get the integer-indexed form of this network,
+            which is rebuilt after any modification       """
+        if self._compiled is None:
+            self._compiled = CompiledRails(self)
+        return self._compiled
 
     def load(self, positions_filename: str, connections_filename: str):
         """
@@ -78,6 +405,7 @@ class Rails:
 
         self.stations = tuple(stations)
         self.speed = sum_speed / self.links
+        self._compiled = None
 
     def copy(self) -> Rails:
         """ Creates a copy of this rail network, for modification """
@@ -88,8 +416,58 @@ class Rails:
         new.links = self.links
         new.min_max = self.min_max
         new.speed = self.speed
+        new.chains = self.chains.copy()
+        new.uncontracted = self.uncontracted
         return new
 
+    def contract(self, max_duration: float = math.inf) -> Rails:
+        """
+        Create a copy of this network where each chain of stations of degree two
+        (see CompiledRails.structure) is replaced by a single connection between
+        its ends. Lines can then only enter a chain to ride it fully, which cuts
+        the depth and branching of searches. The copy keeps the amount of links,
+        as each connection counts for the rails of its chain (see edge_links)
+        :param max_duration: Chains taking longer than this are kept as they are
+        :return: The contracted network, with networks on it being
+                 expanded to this network by Network.expand
+        """
+        graph = self.compile()
+        # A plain copy, also of overlays (see RailsOverlay)
+        new = Rails.copy(self)
+        new.uncontracted = self.uncontracted or self
+        for chain in graph.structure().chains:
+            path = [graph.stations[stn] for stn in chain]
+            first, last = path[0], path[-1]
+            # A chain becomes a simple connection, or isn't contracted
+            if first is last or last in new.connections[first]:
+                continue
+            duration = sum(self.connections[stn_a][stn_b]
+                           for stn_a, stn_b in itertools.pairwise(path))
+            if duration > max_duration:
+                continue
+            del new.connections[first][path[1]]
+            del new.connections[last][path[-2]]
+            for station in path[1:-1]:
+                del new.connections[station]
+            new.connections[first][last] = duration
+            new.connections[last][first] = duration
+            full = tuple(self.expand(path))
+            new.chains[first, last] = full
+            new.chains[last, first] = full[::-1]
+
+        new.stations = tuple(stn for stn in new.stations if stn in new.connections)
+        durations = [dur for conn in new.connections.values() for dur in conn.values()]
+        new.min_max = [min(durations, default=math.inf), max(durations, default=-math.inf)]
+        return new
+
+    def expand(self, stations: Sequence[Station]) -> list[Station]:
+        """ The stations a line through the given stations passes on the
+            uncontracted network, which are the same if not contracted    """
+        path = list(stations[:1])
+        for stn_a, stn_b in itertools.pairwise(stations):
+            path.extend(self.chains.get((stn_a, stn_b), (stn_a, stn_b))[1:])
+        return path
+
     def pivot(self) -> Generator[Rails]:
         """ Yields copies of this rail network """
         while True:
@@ -107,21 +485,19 @@ class Rails:
 
         for _ in range(count):
             origin = random.choice(self.stations)
-            old_outgoing = list(self.connections[origin].keys())
-            old_dest = random.choice(old_outgoing)
+            old_dest = random.choice(self.neighbours(origin))
             self._swap_rail(origin, old_dest)
 
     def _swap_rail(self, origin: Station, old_dest: Station):
-        new_dest = random.choice([dest for dest in self.stations
-                                  if dest not in self.connections[origin]
-                                  and dest is not origin])
-        duration = self._est_time(origin, new_dest)
-        del self.connections[origin][old_dest]
-        del self.connections[old_dest][origin]
-        self.connections[origin][new_dest] = duration
-        self.connections[new_dest][origin] = duration
+        new_dest = self._random_dest(origin)
+        if new_dest is None:
+            return
+        self._disconnect(origin, old_dest)
+        self._connect(origin, new_dest, self._est_time(origin, new_dest))
+        self._forget(set() if self.degree(old_dest) else {old_dest})
         self.modifications.append(
             RailModification('move_rail', origin, new_dest))
+        self._compiled = None
 
     def add_rails(self, count: int = 3,
                   pairs: list[tuple[str, str]] | None = None):
@@ -134,18 +510,16 @@ class Rails:
 
         for _ in range(count):
             origin = random.choice(self.stations)
-            for station in random.sample(self.stations, len(self.stations)):
-                if station is not origin and station not in self.connections[origin]:
-                    self._add_rail(origin, station)
-                    break
+            dest = self._random_dest(origin)
+            if dest is not None:
+                self._add_rail(origin, dest)
 
     def _add_rail(self, origin: Station, dest: Station):
-        duration = max(self._est_time(origin, dest), 3)
-        self.connections[origin][dest] = duration
-        self.connections[dest][origin] = duration
+        self._connect(origin, dest, max(self._est_time(origin, dest), 3))
         self.links += 1
         self.modifications.append(
             RailModification('add_rail', origin, dest))
+        self._compiled = None
 
     def drop_rails(self, count: int = 3,
                    pairs: list[tuple[str, str]] | None = None):
@@ -158,21 +532,16 @@ class Rails:
 
         for _ in range(count):
             origin = random.choice(self.stations)
-            dest = random.choice(list(self.connections[origin].keys()))
+            dest = random.choice(self.neighbours(origin))
             self._drop_rail(origin, dest)
 
     def _drop_rail(self, origin, dest):
-        del self.connections[origin][dest]
-        del self.connections[dest][origin]
+        self._disconnect(origin, dest)
         self.links -= 1
-
-        if not self.connections[origin]:
-            self.stations = tuple(s for s in self.stations if s is not origin)
-
-        if not self.connections[dest]:
-            self.stations = tuple(s for s in self.stations if s is not dest)
+        self._forget({stn for stn in (origin, dest) if not self.degree(stn)})
         self.modifications.append(
             RailModification('drop_rail', origin, dest))
+        self._compiled = None
 
     def drop_stations(self, count: int = 1, names: list[str] | None = None):
         """ Drop 'count' random stations from the network,
@@ -187,14 +556,53 @@ class Rails:
             self._drop_station(origin)
 
     def _drop_station(self, origin):
-        self.stations = tuple(s for s in self.stations if s is not origin)
-        self.links -= len(self.connections[origin].keys())
-        del self.connections[origin]
+        neighbours = self.connections.pop(origin)
+        self.links -= len(neighbours)
         for conn in self.connections.values():
             if origin in conn:
                 del conn[origin]
+        self._forget({origin} | {stn for stn in neighbours if not self.connections[stn]})
         self.modifications.append(
             RailModification('drop_station', origin))
+        self._compiled = None
+
+    def neighbours(self, station: Station) -> list[Station]:
+        """ The stations connected to a station """
+        return list(self.connections[station])
+
+    def degree(self, station: Station) -> int:
+        """ The amount of rails at a station """
+        return len(self.connections[station])
+
+    def connected(self, stn_a: Station, stn_b: Station) -> bool:
+        """ Whether there is a rail between two stations """
+        return stn_b in self.connections[stn_a]
+
+    def _connect(self, stn_a: Station, stn_b: Station, duration: int):
+        """ Store a rail, in both directions """
+        self.connections[stn_a][stn_b] = duration
+        self.connections[stn_b][stn_a] = duration
+
+    def _disconnect(self, stn_a: Station, stn_b: Station):
+        """ Remove a rail, in both directions """
+        del self.connections[stn_a][stn_b]
+        del self.connections[stn_b][stn_a]
+
+    def _forget(self, stations: set[Station]):
+        """ Remove stations left without rails from the stations """
+        if stations:
+            self.stations = tuple(s for s in self.stations if s not in stations)
+
+    def _random_dest(self, origin: Station) -> Station | None:
+        """ A random station not yet connected to origin, drawn by rejection as
+            most stations are, falling back to drawing from all valid stations  """
+        for _ in range(8):
+            dest = random.choice(self.stations)
+            if dest is not origin and not self.connected(origin, dest):
+                return dest
+        options = [dest for dest in self.stations
+                   if dest is not origin and not self.connected(origin, dest)]
+        return random.choice(options) if options else None
 
     @staticmethod
     def _calc_speed(s_a: Station, s_b: Station, time: int) -> float:
@@ -212,3 +620,132 @@ class Rails:
     def __repr__(self) -> str:
         """ Return a short string summary of the network """
         return f'Rails({len(self.stations)} stations)'
+
+
+class RailsOverlay(Rails):
+    """ Variant of a rail network, given by the rails added to and removed
+        from a base network, which is never copied: creating (or copying)
+        a variant costs the amount of modifications, and modifying it the
+        degree of the stations involved. The connections of the variant
+        are only built when asked for, and its compiled form is patched
+        from that of the base (see CompiledRails.patched)                  """
+
+    def __init__(self, base: Rails):
+        """
+        Create a variant without modifications
+        :param base: The network to vary on, whose own modifications
+                     (if an overlay itself) are carried over
+        """
+        # pylint: disable=super-init-not-called
+        # (stations and connections are derived, so Rails.__init__ can't set them)
+        if isinstance(base, RailsOverlay):
+            self.base = base.base
+            self.added = {stn: conn.copy() for stn, conn in base.added.items()}
+            self.removed = {stn: conn.copy() for stn, conn in base.removed.items()}
+            self.dropped = base.dropped.copy()
+            self.modifications = base.modifications.copy()
+        else:
+            if base.uncontracted is not None:
+                raise ValueError('RailsOverlay -> base must not be contracted')
+            self.base = base
+            # Rails added and removed per station, both stored in both directions
+            self.added: dict[Station, dict[Station, int]] = {}
+            self.removed: dict[Station, set[Station]] = {}
+            # Stations no longer part of the network
+            self.dropped: set[Station] = set()
+            self.modifications = []
+        self.names = base.names
+        self.links = base.links
+        self.min_max = base.min_max
+        self.speed = base.speed
+        self.chains = {}
+        self.uncontracted = None
+        self._stations: tuple[Station, ...] | None = None
+        self._connections: dict[Station, dict[Station, int]] | None = None
+        self._compiled = None
+
+    @property
+    def stations(self) -> tuple[Station, ...]:
+        """ The stations of the base, without those dropped """
+        if self._stations is None:
+            self._stations = tuple(stn for stn in self.base.stations if stn not in self.dropped)
+        return self._stations
+
+    @property
+    def connections(self) -> dict[Station, dict[Station, int]]:
+        """ The connections of the variant, built at first use after a modification """
+        if self._connections is None:
+            connections = {stn: conn.copy() for stn, conn in self.base.connections.items()}
+            for station, removed in self.removed.items():
+                for dest in removed:
+                    del connections[station][dest]
+            for station, added in self.added.items():
+                connections[station].update(added)
+            self._connections = connections
+        return self._connections
+
+    def compile(self) -> CompiledRails:
+        """ Get the integer-indexed form of this network, patched from the base """
+        if self._compiled is None:
+            self._compiled = CompiledRails.patched(self.base.compile(), self)
+        return self._compiled
+
+    def copy(self) -> RailsOverlay:
+        """ Creates a copy of this variant, sharing the base """
+        return RailsOverlay(self)
+
+    def neighbours(self, station: Station) -> list[Station]:
+        """ The stations connected to a station """
+        removed = self.removed.get(station, ())
+        added = self.added.get(station, {})
+        return [dest for dest in self.base.connections[station]
+                if dest not in removed and dest not in added] + list(added)
+
+    def degree(self, station: Station) -> int:
+        """ The amount of rails at a station (re-added rails of
+            the base are both removed and added, so count once) """
+        return len(self.base.connections[station]) - len(self.removed.get(station, ())) \
+            + len(self.added.get(station, ()))
+
+    def connected(self, stn_a: Station, stn_b: Station) -> bool:
+        """ Whether there is a rail between two stations """
+        return stn_b in self.added.get(stn_a, ()) or (
+            stn_b in self.base.connections[stn_a] and stn_b not in self.removed.get(stn_a, ()))
+
+    def _connect(self, stn_a: Station, stn_b: Station, duration: int):
+        """ Record an added rail, in both directions """
+        self.added.setdefault(stn_a, {})[stn_b] = duration
+        self.added.setdefault(stn_b, {})[stn_a] = duration
+        self._connections = None
+
+    def _disconnect(self, stn_a: Station, stn_b: Station):
+        """ Record a removed rail, in both directions """
+        if stn_b in self.added.get(stn_a, ()):
+            del self.added[stn_a][stn_b]
+            del self.added[stn_b][stn_a]
+        else:
+            self.removed.setdefault(stn_a, set()).add(stn_b)
+            self.removed.setdefault(stn_b, set()).add(stn_a)
+        self._connections = None
+
+    def _forget(self, stations: set[Station]):
+        """ Mark stations left without rails as dropped """
+        if stations:
+            self.dropped |= stations
+            self._stations = None
+
+    def _drop_station(self, origin):
+        neighbours = self.neighbours(origin)
+        for dest in neighbours:
+            self._disconnect(origin, dest)
+        self.links -= len(neighbours)
+        self._forget({origin} | {stn for stn in neighbours if not self.degree(stn)})
+        self.modifications.append(
+            RailModification('drop_station', origin))
+        self._compiled = None
+
+    def __repr__(self) -> str:
+        """ Return a short string summary of the variant """
+        return f'RailsOverlay({len(self.stations)} stations,' \
+               f' {sum(map(len, self.added.values())) // 2} added,' \
+               f' {sum(map(len, self.removed.values())) // 2} removed)'
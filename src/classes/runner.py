@@ -16,18 +16,74 @@ Optional parameter list:
         stop_backtracking: Whether backtracking should be prevented
         track_best: Whether the best intermediate state should be tracked
         state_hook: A callable to log the current state
+
+    Search options:
+        table: A TranspositionTable for LookAhead to use
+        table_size: The size of the table LookAhead creates, if none is given
+        share_table: Whether LookAhead runs should share one table (default False)
+        contract: Whether to search on the infrastructure with its chains of
+                  stations contracted (see Rails.contract), which is smaller
+                  but can't end lines inside a chain. Networks are expanded
+                  back to the full infrastructure when returned (default False)
+
+    Time limits:
+        Runner.best and Runner.anytime take a time_limit in seconds. The deadline
+        is also given to each network (see Network.expired), so searches like
+        LookAhead stop within the budget, returning the valid network they have
+
+    Repeated runs (best, anytime and run_till_optimal) stop early
+    once a network reaches the quality bound of the infrastructure
+
+    Parallel options:
+        workers: How many processes to spread repeated runs over (default 1)
+        chunk_size: How many runs a worker does per task (default 8)
 """
 
 from __future__ import annotations
 
+import multiprocessing as mp
+import random
+from collections import deque
 from heapq import nlargest
 from random import sample
+from time import monotonic
 from typing import Type, Generator
 
+import numpy as np
+
 from src.algorithms import standard
-from src.classes.abstract import Algorithm
-from src.classes.lines import Network, NetworkState
+from src.classes.abstract import Algorithm, DeadlineExceeded
+from src.classes.bounds import quality_bound, reaches_bound
+from src.classes.lines import Network, NetworkState, CompactState
 from src.classes.rails import Rails
+from src.classes.transposition import TranspositionTable
+from src.statistics.quantiles import QuantileSketch
+
+# Runner.percentile keeps the scores above the percentile exactly up to this amount
+EXACT_TAIL = 10_000
+
+# The runner of a worker process, set once by the pool initializer
+_remote: Runner | None = None
+
+
+def _init_worker(runner: Runner):
+    """ Give a worker process its runner, and its own random state
+        (forked workers would otherwise all draw the same runs)    """
+    global _remote
+    _remote = runner
+    random.seed()
+    np.random.seed()
+
+
+def _run_chunk(size: int, deadline: float | None = None) -> list[CompactState]:
+    """ Run the worker runner up to 'size' times (before the deadline), returning
+        the lines, score and key of each network (without the infrastructure)    """
+    states = []
+    for _ in range(size):
+        states.append(NetworkState.from_network(_remote.run(deadline)).compact())
+        if deadline is not None and monotonic() >= deadline:
+            break
+    return states
 
 
 class Runner:
@@ -53,19 +109,34 @@ class Runner:
         self.state_hook = opt.get('state_hook', None)
         self.dist_cap = opt.get('dist_cap', 180)
         self.line_cap = opt.get('line_cap', 20)
+        self.workers = opt.get('workers', 1)
+        self.chunk_size = opt.get('chunk_size', 8)
         self.options = opt
+        # The contracted infrastructure, and the infrastructure it was contracted from
+        self._contracted: tuple[Rails, Rails] | None = None
+        if opt.get('share_table', False) and 'table' not in opt:
+            self.options['table'] = TranspositionTable(opt.get('table_size', 200_000))
 
-    def run(self) -> Network:
-        """ Run the algorithm once, returning the final network """
+    def run(self, deadline: float | None = None) -> Network:
+        """ Run the algorithm once, returning the final network.
+            If a deadline (see time.monotonic) is given, the run
+            stops at that time with the network it has so far    """
+        return self._run(deadline).expand()
+
+    def _run(self, deadline: float | None) -> Network:
+        """ Run the algorithm once, returning the final network
+            on the infrastructure searched on (see search_infra) """
         if self.start == 'clean' or self.start.startswith('stations '):
-            base = Network(self.infra, self.dist_cap)
+            base = Network(self.search_infra, self.dist_cap)
             self._alloc_stations(base)
         elif self.start in ['greedy', 'random']:
             alg = standard.Greedy if self.start == 'greedy' else standard.Random
-            base = Runner(alg, self.infra,
-                          dist_cap=self.dist_cap, line_cap=self.line_cap).run()
+            # Not expanded, so the start stays on the contracted infrastructure
+            base = Runner(alg, self.search_infra,
+                          dist_cap=self.dist_cap, line_cap=self.line_cap)._run(deadline)
         else:
             raise ValueError('Runner -> start invalid. See documentation at top of file')
+        base.deadline = deadline
         alg_inst = self.alg(base, **self.options)
 
         net = self._run_loop(alg_inst)
@@ -73,12 +144,23 @@ class Runner:
             net.trim()
         return net
 
+    @property
+    def search_infra(self) -> Rails:
+        """ The infrastructure algorithms search on, which is the contracted
+            infrastructure with the contract option (networks are returned
+            on self.infra), kept until self.infra is replaced               """
+        if not self.options.get('contract', False):
+            return self.infra
+        if self._contracted is None or self._contracted[1] is not self.infra:
+            self._contracted = self.infra.contract(self.dist_cap), self.infra
+        return self._contracted[0]
+
     def _alloc_stations(self, net: Network) -> None:
         if self.start == 'clean':
             return
         if self.start == 'stations random':
             try:
-                for root in sample(net.rails.stations, self.line_cap):
+                for root in sample(net.graph.station_ids(net.rails.stations), self.line_cap):
                     net.add_line(root)
                 return
             except ValueError as exc:
@@ -90,8 +172,8 @@ class Runner:
                              " of 'stations none', 'stations random'"
                              " or 'stations degree'")
         odd, even = [], []
-        for station, links in net.link_count.items():
-            if len(links) % 2:
+        for station, degree in enumerate(net.graph.degree):
+            if degree % 2:
                 odd.append(station)
             else:
                 even.append(station)
@@ -102,47 +184,101 @@ class Runner:
         for root in sample(even, self.line_cap - len(odd)):
             net.add_line(root)
 
+    @property
+    def quality_bound(self) -> float:
+        """ An upper bound on the quality of networks this configuration can find """
+        return quality_bound(self.infra, self.line_cap, self.dist_cap)
+
     def _run_loop(self, alg_inst: Algorithm) -> Network:
         """ Run the given instance with the runner options """
         intermediate = alg_inst.active
 
         visited = None
         if self.options.get('stop_backtracking', False):
-            visited = set(NetworkState.from_network(alg_inst.active))
+            visited = {NetworkState.from_network(intermediate)}
         best = None
         if self.options.get('track_best', False):
             best = NetworkState.from_network(intermediate)
-        hook = None
-        if self.state_hook is not None:
-            hook = self.state_hook
-
-        action = visited or best or hook
-
-        for intermediate in alg_inst:
-            if action:
-                state = NetworkState.from_network(intermediate)
+        hook = self.state_hook
+        mark = len(intermediate.journal)
 
-                if visited:
+        try:
+            for intermediate in alg_inst:
+                if visited is not None:
+                    state = NetworkState.from_network(intermediate)
                     if state in visited:
                         break
                     visited.add(state)
-                if best:
-                    best = max(best, state, key=lambda s: s.score)
-                if hook:
-                    hook(state)
+                if best is not None and intermediate.quality() > best.score:
+                    best = NetworkState.from_network(intermediate)
+                if hook is not None:
+                    hook(NetworkState.from_network(intermediate))
+                if intermediate.expired():
+                    break
+        except DeadlineExceeded:
+            # Drop the moves the interrupted search had applied
+            intermediate = alg_inst.active
+            intermediate.rewind(mark)
 
-        if best:
-            return Network.from_state(best)
+        if best is not None:
+            return Network.from_state(best, self.dist_cap)
         return intermediate
 
-    def runs(self, bound: int | None = None) -> Generator[Network]:
-        """ Yield networks, up to a limit if specified """
-        if bound is None:
+    def runs(self, bound: int | None = None,
+             time_limit: float | None = None) -> Generator[Network]:
+        """ Yield networks, up to a limit and for at most
+            'time_limit' seconds if specified (always at least one) """
+        if self._parallel(bound):
+            for state in self.states(bound, time_limit):
+                yield Network.from_state(state, self.dist_cap)
+            return
+
+        deadline = None if time_limit is None else monotonic() + time_limit
+        count = 0
+        while bound is None or count < bound:
+            yield self.run(deadline)
+            count += 1
+            if deadline is not None and monotonic() >= deadline:
+                return
+
+    def states(self, bound: int | None = None,
+               time_limit: float | None = None) -> Generator[NetworkState]:
+        """ Yield the states of networks, like runs(), spread
+            over 'workers' processes if there are multiple    """
+        if not self._parallel(bound):
+            for net in self.runs(bound, time_limit):
+                yield NetworkState.from_network(net)
+            return
+
+        deadline = None if time_limit is None else monotonic() + time_limit
+
+        # Heuristics are often closures, which can't be pickled to spawned workers
+        methods = mp.get_all_start_methods()
+        context = mp.get_context('fork' if 'fork' in methods else None)
+        remaining = bound
+        pending = deque()
+        with context.Pool(self.workers, _init_worker, (self,)) as pool:
+            # The first chunk is submitted even past the deadline, so like
+            #   runs(), at least one network is yielded
+            first = True
             while True:
-                yield self.run()
+                # Keep every worker busy, without queueing unbounded amounts of runs
+                while len(pending) < 2 * self.workers and remaining != 0 \
+                        and (first or deadline is None or monotonic() < deadline):
+                    first = False
+                    size = self.chunk_size if remaining is None \
+                        else min(self.chunk_size, remaining)
+                    if remaining is not None:
+                        remaining -= size
+                    pending.append(pool.apply_async(_run_chunk, (size, deadline)))
+                if not pending:
+                    return
+                for compact in pending.popleft().get():
+                    yield NetworkState.from_compact(compact, self.infra)
 
-        for _ in range(bound):
-            yield self.run()
+    def _parallel(self, bound: int | None) -> bool:
+        """ Whether runs up to 'bound' should be spread over worker processes """
+        return self.workers > 1 and (bound is None or bound > 1)
 
     def run_till_cover(self) -> Network:
         """ Repeatedly run until the solution has 100% coverage """
@@ -153,24 +289,52 @@ class Runner:
 
     def run_till_optimal(self) -> Network:
         """ Repeatedly run until a fully-covering, non-overlapping solution is found """
+        bound = self.quality_bound
         for sol in self.runs():
-            if sol.is_optimal():
+            if sol.is_optimal() or reaches_bound(sol.quality(), bound):
                 return sol
         raise ValueError  # Typechecker
 
-    def best(self, bound: int = 1_000) -> Network:
-        """ Repeatedly run until optimal or bound and return the highest scoring network """
-        return max(self.runs(bound))
+    def best(self, bound: int | None = None, time_limit: float | None = None) -> Network:
+        """ Repeatedly run until bound (default 1000 runs without a time limit)
+            or time_limit seconds and return the highest scoring network        """
+        if bound is None and time_limit is None:
+            bound = 1_000
+        best = None
+        for best in self.anytime(time_limit, bound):
+            pass
+        return best
+
+    def anytime(self, time_limit: float | None,
+                bound: int | None = None) -> Generator[Network]:
+        """ Repeatedly run for time_limit seconds (or until bound),
+            yielding each network that beats the best found so far.
+            Stops once a network reaches the quality bound           """
+        highest, limit = None, self.quality_bound
+        for state in self.states(bound, time_limit):
+            if highest is None or state.score > highest:
+                highest = state.score
+                yield Network.from_state(state, self.dist_cap)
+                if reaches_bound(highest, limit):
+                    return
 
     def average(self, count: int = 1_000) -> float:
         """ Repeatedly run and return the average quality solution generated """
-        return sum(sol.quality() for sol in self.runs(count)) / count
+        return sum(state.score for state in self.states(count)) / count
 
     def percentile(self, nth: int = 90, bound: int = 1_000) -> float:
-        """ Repeatedly run and return the average quality above the nth percentile """
+        """ Repeatedly run and return the average quality above the nth percentile.
+            This is exact while at most EXACT_TAIL scores are above it, and is
+            otherwise estimated by a QuantileSketch, so memory doesn't grow
+            with the bound                                                    """
         count = round(bound * (1 - nth / 100))
-        top = nlargest(count, (sol.quality() for sol in self.runs(bound)))
-        return sum(top) / count
+        if count <= EXACT_TAIL:
+            top = nlargest(count, (state.score for state in self.states(bound)))
+            return sum(top) / count
+        sketch = QuantileSketch(k=1_000)
+        for state in self.states(bound):
+            sketch.update(state.score)
+        return sketch.tail_mean(nth / 100)
 
     @property
     def name(self):
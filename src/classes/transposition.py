@@ -0,0 +1,97 @@
+""" Class caching search results for network states """
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Literal
+
+from src.classes.rails import CompiledRails
+
+
+class TranspositionTable:
+    """ Bounded table of the best quality reachable from a network state
+        within a number of remaining moves, keyed by network hash        """
+
+    def __init__(self, size: int = 200_000,
+                 policy: Literal['lru'] | Literal['depth'] = 'lru'):
+        """
+        Create an empty table
+        :param size: The maximum amount of entries kept
+        :param policy: What to evict when full, either the least recently
+                       used entry, or the oldest entry of the lowest depth
+        """
+        if policy not in ('lru', 'depth'):
+            raise ValueError("TranspositionTable -> policy must be 'lru' or 'depth'")
+        self.size = size
+        self.policy = policy
+        # One bucket of entries per depth, in order of use
+        self.buckets: dict[int, OrderedDict[int, float]] = {}
+        # Order of use across depths, only kept for LRU eviction
+        self.order: OrderedDict[tuple[int, int], None] = OrderedDict()
+        self.entries = 0
+        self.graph: CompiledRails | None = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, graph: CompiledRails):
+        """ Use the table for networks on the given infrastructure,
+            discarding entries if it was used for different infrastructure """
+        if graph is not self.graph:
+            self.clear()
+            self.graph = graph
+
+    def lookup(self, key: int, depth: int) -> float | None:
+        """ The stored value of a state at a remaining depth, if present """
+        bucket = self.buckets.get(depth)
+        if bucket is None or key not in bucket:
+            self.misses += 1
+            return None
+        self.hits += 1
+        bucket.move_to_end(key)
+        if self.policy == 'lru':
+            self.order.move_to_end((depth, key))
+        return bucket[key]
+
+    def store(self, key: int, depth: int, value: float):
+        """ Store the value of a state at a remaining depth """
+        bucket = self.buckets.setdefault(depth, OrderedDict())
+        if key not in bucket:
+            self.entries += 1
+        bucket[key] = value
+        bucket.move_to_end(key)
+        if self.policy == 'lru':
+            self.order[(depth, key)] = None
+            self.order.move_to_end((depth, key))
+        while self.entries > self.size:
+            self._evict()
+
+    def _evict(self):
+        """ Remove one entry according to the eviction policy """
+        if self.policy == 'lru':
+            depth, key = self.order.popitem(last=False)[0]
+            del self.buckets[depth][key]
+        else:
+            depth = min(d for d, bucket in self.buckets.items() if bucket)
+            self.buckets[depth].popitem(last=False)
+        self.entries -= 1
+
+    def clear(self):
+        """ Remove all entries, keeping the counters """
+        self.buckets.clear()
+        self.order.clear()
+        self.entries = 0
+
+    def hit_rate(self) -> float:
+        """ The fraction of lookups that found a stored value """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def __len__(self) -> int:
+        """ The amount of entries stored """
+        return self.entries
+
+    def __repr__(self) -> str:
+        """ Represent the table and its counters in a short format """
+        return f'TranspositionTable({self.entries}/{self.size} entries,' \
+               f' {self.hits} hits, {self.misses} misses)'
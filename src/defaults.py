@@ -4,7 +4,8 @@ from __future__ import annotations
 
 from functools import partial
 
-from src.algorithms import standard, generic, heuristics, adjusters
+from src.algorithms import standard, generic, heuristics, adjusters, \
+    pool, lns, acceptance, tempering, genetic, colony
 from src.classes import rails, runner
 
 INFRA_FILES = [('data/positions_small.csv', 'data/connections_small.csv'),
@@ -32,7 +33,17 @@ std_gr = rr(standard.Greedy, track_best=True)
 std_pr = rr(standard.Perfectionist)
 std_hc = rr(standard.HillClimb, start='greedy')
 std_la = rr(standard.LookAhead, stop_backtracking=True, track_best=True, start='clean', depth=3)
+# Searching on the contracted infrastructure cuts depth and branching (see Rails.contract)
+std_la_ct = rr(standard.LookAhead, stop_backtracking=True, track_best=True,
+               depth=3, contract=True, tag='contract')
+std_bs = rr(standard.BeamSearch, width=32, expand=6, tag='w32-e6')
 std_sa = rr(standard.SimulatedAnnealing, start='greedy', iter_cap=100, tag=100)
+std_sa_lazy = rr(standard.SimulatedAnnealing, start='greedy', lazy=True,
+                 iter_cap=100_000, track_best=True, tag='lazy-100k')
+std_ts = rr(standard.TabuSearch, start='greedy', iter_cap=5_000, tag='5k')
+
+# Four annealing chains, each in its own process if there are enough cores
+sa_pt = rr(tempering.ParallelTempering, start='greedy', chains=4, tag='4c')
 
 # Warning: absurdly slow! Like, 3 mins per result on NH
 cst_la = rr(
@@ -62,6 +73,19 @@ cst_nf = rr(
     tag='nf-s6'
 )
 
+# Picks lines from all maximal paths, a few seconds per result on NL
+pool_sc = rr(pool.SetCover, tag='k20')
+
+# Rebuilds lines near a random station, about a second per result on NL
+lns_rg = rr(lns.LargeNeighbourhood, start='greedy', destroy='region',
+            accept=acceptance.non_worsening(), tag='region')
+
+# Recombines lines of a population of 20 networks for 30 generations
+ga_20 = rr(genetic.Genetic, start='greedy', population=20, tag='p20')
+
+# Ten ants for twenty iterations, pheromone is shared between runs
+aco_10 = rr(colony.AntColony, ants=10, tag='a10')
+
 # If you want to experiment yourself:
 custom_runner: runner.Runner = rr(
     generic.Constructive,
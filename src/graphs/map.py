@@ -31,9 +31,11 @@ LINE_COLOURS = ['blue', 'orange', 'green', 'purple', 'brown', 'pink', 'olive', '
 
 def ax_draw_network(axes: plt.Axes, net: lines.Network):
     """ Draw a network on the given axes """
+    stations = net.graph.stations
     for line, colour, num in zip(net.lines, itertools.cycle(LINE_COLOURS), range(len(net.lines))):
-        for s_a, s_b in itertools.pairwise(line.stations):
-            if net.link_count[s_a][s_b] == 1:
+        for id_a, id_b in itertools.pairwise(line.stations):
+            s_a, s_b = stations[id_a], stations[id_b]
+            if net.link_count[net.graph.edge(id_a, id_b)] == 1:
                 axes.plot((s_a.E, s_b.E), (s_a.N, s_b.N),
                           color=colour, zorder=-1)
             else:
@@ -46,8 +48,10 @@ def ax_draw_network(axes: plt.Axes, net: lines.Network):
                    f'Coverage: {net.coverage():.0%}'
                    f'    Over-time: {net.overtime}',
                    color=('white' if PRESENTATION else 'black'))
-    for s_a, unlinked in net.link_count.items():
-        for s_b in (station for station, links in unlinked.items() if not links):
+    for edge, links in enumerate(net.link_count):
+        if not links:
+            s_a = stations[net.graph.edge_origin[edge]]
+            s_b = stations[net.graph.edge_dest[edge]]
             if PRESENTATION:
                 axes.plot((s_a.E, s_b.E), (s_a.N, s_b.N), color='#222222',
                           linewidth=1, zorder=0)
@@ -0,0 +1,55 @@
+""" Micro-benchmarks for the hot paths of the state space representation """
+
+from __future__ import annotations
+
+import timeit
+from copy import copy
+
+from src.classes.lines import Network
+from src.classes.rails import Rails
+from src.classes.runner import Runner
+from src.defaults import default_runner as runner, INFRA_FILES
+
+REPEATS = 10_000
+
+
+def _legacy_link_count(net: Network) -> dict[int, dict[int, int]]:
+    """ Rebuild the nested per-station link counts networks used to store,
+        with every edge present twice                                      """
+    graph = net.graph
+    return {
+        stn: {dest: net.link_count[edge] for dest, _, edge in graph.adjacency[stn]}
+        for stn in range(len(graph))
+    }
+
+
+def copy_cost(infra: Rails | None = None, repeats: int = REPEATS) -> tuple[float, float]:
+    """
+    Compare the cost of copying a network with flat edge-count buffers
+    against the nested dictionaries of link counts that were used before
+    :param infra: The infrastructure to benchmark on (default: the NL case)
+    :param repeats: How many copies to time
+    :return: Seconds per copy for the legacy and the current representation
+    """
+    if infra is None:
+        infra = Rails()
+        infra.load(*INFRA_FILES[True])
+    net = Runner(runner.alg, infra, runner.start, **runner.options).run()
+    legacy = _legacy_link_count(net)
+
+    def _legacy_copy():
+        new = Network(net.rails)
+        new.lines = [line.copy(new) for line in net.lines]
+        new.link_count = {stn: copy(conn) for stn, conn in legacy.items()}
+        new.free_degree = copy(net.free_degree)
+
+    legacy_time = timeit.timeit(_legacy_copy, number=repeats) / repeats
+    flat_time = timeit.timeit(net.copy, number=repeats) / repeats
+    return legacy_time, flat_time
+
+
+if __name__ == '__main__':
+    print(f'Timing {REPEATS} network copies on the NL case for {runner.name}...')
+    old, new = copy_cost()
+    print(f'Nested dicts: {old * 1e6:.1f} µs per copy')
+    print(f'Flat buffers: {new * 1e6:.1f} µs per copy ({old / new:.1f}x faster)')
@@ -1,7 +1,17 @@
-""" Functions to generate distribution data for run configurations """
+""" Functions to generate distribution data for run configurations
+
+Runs are done in many small tasks, whose histograms are merged into the
+results file as they arrive (and written every SAVE_INTERVAL seconds).
+A checkpoint next to the results file holds the histogram from before
+the session and the amount of runs asked for, so an interrupted session
+resumes where it stopped when started again. Scores are also kept in a
+QuantileSketch (saved next to the histogram), for percentiles without
+the resolution of the histogram bins
+"""
 
 from __future__ import annotations
 
+import math
 import os.path
 import time
 from multiprocessing import Pool
@@ -9,59 +19,133 @@ from multiprocessing import Pool
 import numpy as np
 
 import src.statistics.mp_setup as setup
-from src.classes.lines import Network
-from src.defaults import default_runner as runner, INFRA_LARGE, default_infra
+from src.statistics.quantiles import QuantileSketch
+from src.classes.bounds import reaches_bound
+from src.classes.lines import Network, NetworkState, CompactState
+from src.defaults import default_runner as runner, INFRA_LARGE
 
 SIZE = 1_000_000
+# Runs per task, small enough for a live ETA and little lost work on a crash
+TASK_SIZE = 500
+# Seconds between writes of the results file
+SAVE_INTERVAL = 30
 
 
-def _dist(size: int):
-    """ Worker thread function """
+def _dist(size: int) -> tuple[np.ndarray, QuantileSketch, float, CompactState | None, bool]:
+    """ Worker function: the histogram and sketch of 'size' runs, the best score
+        and state among them, and whether that reached the quality bound        """
     arr = np.zeros(1_000, dtype='uint32')
-    best = 0, None
-    for net in runner.runs(size):
-        score = net.quality()
-        if score > best[0]:
-            best = score, net
-        arr[int(score // 10)] += 1
-    return arr, best
-
-
-def dist():
-    """ Gather distribution data for the default runner """
-    print(f'Recording {SIZE} runs on {setup.PROCESSES} threads for {runner.name}...')
-    start = time.time()
-    w_size = (int(SIZE // setup.PROCESSES),)
-    args = [(_dist, (w_size,)) for _ in range(setup.PROCESSES)]
-    with Pool(setup.PROCESSES) as pool:
-        ret = pool.map(setup.worker, args)
+    sketch = QuantileSketch()
+    best, best_state = -math.inf, None
+    bound = runner.quality_bound
+    for state in runner.states(size):
+        arr[int(state.score // 10)] += 1
+        sketch.update(state.score)
+        if state.score > best:
+            best, best_state = state.score, state.compact()
+        if reaches_bound(state.score, bound):
+            return arr, sketch, best, best_state, True
+    return arr, sketch, best, best_state, False
 
-    print('Took', round(time.time() - start), 'seconds')
-    res: np.ndarray = sum(d[w_size][0] for d in ret)
-    best: tuple[float, Network] = max((d[w_size][1] for d in ret), key=lambda t: t[0])
 
-    dist_file = f'results/statistics/dist/{"nl" if INFRA_LARGE else "nh"}_{runner.name}.npy'
-    if not os.path.isfile(dist_file):
-        os.makedirs(os.path.dirname(dist_file), exist_ok=True)
-        np.save(dist_file, res)
+def _save(path: str, arr: np.ndarray | None = None, **arrays: np.ndarray):
+    """ Write an array (or named arrays, as .npz) to 'path', through a temporary
+        file so an interruption never leaves a partially written file behind   """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as file:
+        if arrays:
+            if arr is not None:
+                arrays['arr'] = arr
+            np.savez(file, **arrays)
+        else:
+            np.save(file, arr)
+    os.replace(tmp, path)
+
+
+def _record(path: str) -> float:
+    """ The score of the recorded best solution, if any """
+    if not os.path.isfile(path):
+        return -math.inf
+    with open(path, 'r', encoding='utf-8') as file:
+        return Network.from_output(file.read(), runner.infra).quality()
+
+
+def _write_record(path: str, state: CompactState):
+    """ Replace the recorded best solution """
+    net = Network.from_state(NetworkState.from_compact(state, runner.infra), runner.dist_cap)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(net.to_output())
+    os.replace(path + '.tmp', path)
+
+
+def dist(size: int = SIZE):
+    """ Gather distribution data for the default runner, resuming
+        an interrupted session (of its original size) if there is one """
+    prefix = 'nl' if INFRA_LARGE else 'nh'
+    dist_file = f'results/statistics/dist/{prefix}_{runner.name}.npy'
+    checkpoint = f'results/statistics/dist/{prefix}_{runner.name}.checkpoint.npz'
+    sketch_file = f'results/statistics/dist/{prefix}_{runner.name}.sketch.npz'
+    record_file = f'results/solutions/{prefix}.csv'
+    os.makedirs(os.path.dirname(dist_file), exist_ok=True)
+
+    total = np.load(dist_file) if os.path.isfile(dist_file) else np.zeros(1_000, dtype='uint32')
+    if os.path.isfile(sketch_file):
+        with np.load(sketch_file) as data:
+            sketch = QuantileSketch.from_arrays(**data)
     else:
-        last = np.load(dist_file)
-        np.save(dist_file, res + last)
-
-    record_file = f'results/solutions/{"nl" if INFRA_LARGE else "nh"}.csv'
-    if not os.path.isfile(record_file):
-        os.makedirs(os.path.dirname(record_file), exist_ok=True)
-        with open(record_file, 'w', encoding='utf-8') as file:
-            file.write(best[1].to_output())
+        sketch = QuantileSketch()
+    if os.path.isfile(checkpoint):
+        with np.load(checkpoint) as data:
+            base, size = data['arr'], int(data['size'])
+        # Runs merged into the results file are done, whether or not they were checkpointed
+        done = int((total - base).sum())
+        print(f'Resuming: {done} of {size} runs already recorded for {runner.name}')
     else:
-        with open(record_file, 'r', encoding='utf-8') as file:
-            last = Network.from_output(file.read(), default_infra)
-        if best[0] > last.quality():
-            print('Best solution improved to', best[0])
-            with open(record_file, 'w', encoding='utf-8') as file:
-                file.write(best[1].to_output())
-        else:
-            print(f'Best solution ({best[0]}) under record ({last.quality()})')
+        base, done = total.copy(), 0
+        _save(checkpoint, base, size=np.array(size))
+
+    remaining = max(size - done, 0)
+    tasks = [TASK_SIZE] * (remaining // TASK_SIZE)
+    if remaining % TASK_SIZE:
+        tasks.append(remaining % TASK_SIZE)
+    print(f'Recording {remaining} runs on {setup.PROCESSES} threads for {runner.name}...')
+
+    start = time.time()
+    previous = record = _record(record_file)
+    best = -math.inf
+    progress = setup.Progress(size, f'{runner.name}: ', done=done)
+    last_save = time.monotonic()
+    with Pool(setup.PROCESSES, setup.seed_worker) as pool:
+        try:
+            for arr, part, score, state, reached in pool.imap_unordered(_dist, tasks):
+                total += arr
+                sketch.merge(part)
+                progress.update(int(arr.sum()))
+                best = max(best, score)
+                if state is not None and score > record:
+                    record = score
+                    _write_record(record_file, state)
+                if reached:
+                    print(f'Quality bound ({runner.quality_bound:.0f}) reached, stopping early')
+                    break
+                if time.monotonic() - last_save >= SAVE_INTERVAL:
+                    _save(sketch_file, **sketch.arrays())
+                    _save(dist_file, total)
+                    last_save = time.monotonic()
+        finally:
+            # Also on an interruption, keeping the checkpoint to resume from
+            _save(sketch_file, **sketch.arrays())
+            _save(dist_file, total)
+    os.remove(checkpoint)
+
+    print('Took', round(time.time() - start), 'seconds')
+    if record > previous:
+        print('Best solution improved to', record)
+    else:
+        print(f'Best solution ({best}) under record ({record})')
+    perc_50, perc_90 = sketch.quantiles([.5, .9])
+    print(f'Percentiles over {len(sketch)} runs: 50th {perc_50:.1f}, 90th {perc_90:.1f}')
     print('Saved to', dist_file)
 
 
@@ -2,14 +2,18 @@
 
 from __future__ import annotations
 
+import math
+import os
 import time
-from collections import ChainMap
-from multiprocessing import Pool
+from operator import itemgetter
+from statistics import NormalDist
 
 import numpy as np
 
 import src.statistics.mp_setup as setup
+from src.statistics.quantiles import histogram_percentiles
 from src.algorithms import generic, heuristics, adjusters
+from src.classes.rails import RailsOverlay
 from src.classes.runner import Runner
 from src.defaults import rr, INFRA_LARGE, default_infra
 
@@ -17,6 +21,17 @@ SAMPLE_SIZE = 10_000
 MAX_N = 10
 MOD_WIDTH = 40
 BIN_SIZE = 1
+# Runs per unit of work handed to a worker, see mp_setup.schedule
+UNIT_SIZE = 1_000
+
+# Adaptive sampling: a cell stops once the confidence intervals of its percentiles
+#   are at most TOLERANCE wide, leaving its share of the runs to noisier cells
+ADAPTIVE = True
+PERCENTILES = (.5, .9)
+TOLERANCE = 10
+CONFIDENCE = .95
+MIN_SAMPLE = 2 * UNIT_SIZE
+MAX_SAMPLE = 5 * SAMPLE_SIZE
 
 
 def _get_runner(soft_level: int) -> Runner:
@@ -41,7 +56,7 @@ def _get_runner(soft_level: int) -> Runner:
 
 
 def _get_infra(infra_mod: int):
-    infra = default_infra.copy()
+    infra = RailsOverlay(default_infra)
     if infra_mod > 0:
         infra.add_rails(count=infra_mod)
     elif infra_mod < 0:
@@ -49,11 +64,11 @@ def _get_infra(infra_mod: int):
     return infra
 
 
-def _task(soft_level: int, infra_mod: int):
-    """ Worker thread function """
+def _task(soft_level: int, infra_mod: int, size: int):
+    """ Worker thread function: the histogram of 'size' runs """
     arr = np.zeros(10_000 // BIN_SIZE, dtype='uint32')
     runner = _get_runner(soft_level)
-    for _ in range(SAMPLE_SIZE // 10):
+    for _ in range(size // 10):
         runner.infra = _get_infra(infra_mod)
         for net in runner.runs(10):
             score = net.quality()
@@ -73,10 +88,8 @@ def experiment():
     if not setup.safety_check(path50) or not setup.safety_check(path90):
         return
 
-    estimate = 0.0003125 * SAMPLE_SIZE * MAX_N * MOD_WIDTH * setup.PROCESSES
-    print(
-        f"Running experiment, estimated completion "
-        f"{time.strftime('%H:%M', time.gmtime(time.time() + 60 * 60 * 2 + estimate))}")
+    print(f'Running experiment on {setup.PROCESSES} threads,'
+          f' the ETA settles once every infrastructure modification has been timed')
     start = time.time()
 
     with setup.NoSleep():
@@ -93,35 +106,99 @@ def experiment():
         print('Done. Experiment took', round(time.time() - start), 'seconds')
 
 
-def _analyse_results(ret: ChainMap[tuple[int, int], np.ndarray]):
-    perc_50 = np.zeros((MAX_N, 2 * MOD_WIDTH + 1))
-    perc_90 = np.zeros((MAX_N, 2 * MOD_WIDTH + 1))
-    with np.nditer([perc_50, perc_90], flags=['multi_index'], op_flags=['writeonly']) as nditer:
-        for p5_loc, p9_loc in nditer:
-            dist: np.ndarray = ret[(nditer.multi_index[0] + 1, nditer.multi_index[1] - MOD_WIDTH)]
-            tot = dist.sum()
-            p5_val, p9_val = None, None
-            for score, count in zip(range(0, 10_000, BIN_SIZE), dist.cumsum()):
-                if p5_val is None and count >= tot * 0.5:
-                    # This is the first time we see a 50th percentile score
-                    p5_val = score
-                if count >= tot * 0.9:
-                    # We see a 90th percentile score
-                    p9_val = score
-                    break
-            p5_loc[...] = p5_val
-            p9_loc[...] = p9_val
+def _analyse_results(ret: dict[tuple[int, int], np.ndarray]):
+    grid = np.array([[ret[soft_level, infra_mod]
+                      for infra_mod in range(-MOD_WIDTH, MOD_WIDTH + 1)]
+                     for soft_level in range(1, MAX_N + 1)])
+    perc_50, perc_90 = np.moveaxis(
+        histogram_percentiles(grid, PERCENTILES, BIN_SIZE).astype(float), -1, 0)
     return perc_50, perc_90
 
 
-def _run_experiment():
-    targets = [(soft_level, infra_mod)
-               for soft_level in range(1, MAX_N + 1)
-               for infra_mod in range(-MOD_WIDTH, MOD_WIDTH + 1)]
-    args = [(_task, ch) for ch in
-            (setup.chunk(targets, setup.PROCESSES))]
-    with Pool(setup.PROCESSES) as pool:
-        ret = ChainMap(*pool.map(setup.worker, args))
+def _interval(dist: np.ndarray, quantile: float) -> tuple[int, int]:
+    """ Distribution-free confidence interval on a percentile of a histogram:
+        the scores of the order statistics whose ranks bound it (by the
+        normal approximation of the binomial distribution of the rank)    """
+    total = int(dist.sum())
+    spread = NormalDist().inv_cdf((1 + CONFIDENCE) / 2) * math.sqrt(total * quantile * (1 - quantile))
+    ranks = [max(math.floor(total * quantile - spread), 1),
+             min(math.ceil(total * quantile + spread), total)]
+    lower, upper = np.searchsorted(dist.cumsum(), ranks) * BIN_SIZE
+    return int(lower), int(upper)
+
+
+def _width(dist: np.ndarray) -> float:
+    """ The widest confidence interval of the percentiles of a cell """
+    if dist.sum() < MIN_SAMPLE:
+        return math.inf
+    return max(upper - lower for lower, upper in
+               (_interval(dist, quantile) for quantile in PERCENTILES))
+
+
+class _Sampler:
+    """ Hands out units of runs to the cells whose percentiles are least
+        certain, until every cell is within the tolerance (or at MAX_SAMPLE)
+        or the runs of SAMPLE_SIZE per cell are spent                         """
+
+    def __init__(self, cells: list[tuple[int, int]]):
+        self.results = {cell: np.zeros(10_000 // BIN_SIZE, dtype='uint32') for cell in cells}
+        self.widths = {cell: math.inf for cell in cells}
+        self.handed = {cell: 0 for cell in cells}
+        self.running = {cell: 0 for cell in cells}
+        self.budget = SAMPLE_SIZE * len(cells)
+
+    def refill(self) -> list[tuple[int, int, int]]:
+        """ A unit for the least certain cell that isn't waiting on others, if any """
+        if sum(self.handed.values()) + UNIT_SIZE > self.budget:
+            return []
+        unsettled = [cell for cell, width in self.widths.items()
+                     if width > TOLERANCE and self.handed[cell] < MAX_SAMPLE]
+        # Few unsettled cells get several units at a time, to keep the workers busy
+        limit = max(1, 2 * setup.PROCESSES // max(len(unsettled), 1))
+        ready = [cell for cell in unsettled if self.running[cell] < limit]
+        if not ready:
+            return []
+        cell = max(ready, key=lambda cell: (self.widths[cell], -self.handed[cell]))
+        self.handed[cell] += UNIT_SIZE
+        self.running[cell] += 1
+        return [(*cell, UNIT_SIZE)]
+
+    def record(self, cell: tuple[int, int], arr: np.ndarray):
+        """ Add the histogram of a completed unit to its cell """
+        self.running[cell] -= 1
+        self.results[cell] += arr
+        self.widths[cell] = _width(self.results[cell])
+
+
+def _run_adaptive() -> dict[tuple[int, int], np.ndarray]:
+    """ Run the cells with adaptive sampling, see _Sampler """
+    sampler = _Sampler([(soft_level, infra_mod)
+                        for soft_level in range(1, MAX_N + 1)
+                        for infra_mod in range(-MOD_WIDTH, MOD_WIDTH + 1)])
+    for (soft_level, infra_mod, _), arr in setup.schedule(
+            _task, [], key=itemgetter(1), label='Units: ', refill=sampler.refill,
+            total=sampler.budget // UNIT_SIZE):
+        sampler.record((soft_level, infra_mod), arr)
+
+    runs = sum(sampler.handed.values())
+    unsettled = sum(width > TOLERANCE for width in sampler.widths.values())
+    print(f'Used {runs} of {sampler.budget} runs, {unsettled} cells outside the tolerance')
+    return sampler.results
+
+
+def _run_experiment() -> dict[tuple[int, int], np.ndarray]:
+    """ Run every (soft_level, infra_mod) cell in units of UNIT_SIZE runs,
+        handed out on demand. Runs get slower with more rails, so the
+        cost of units is learned per infrastructure modification        """
+    if ADAPTIVE:
+        return _run_adaptive()
+    ret = {(soft_level, infra_mod): np.zeros(10_000 // BIN_SIZE, dtype='uint32')
+           for soft_level in range(1, MAX_N + 1)
+           for infra_mod in range(-MOD_WIDTH, MOD_WIDTH + 1)}
+    units = [(*cell, UNIT_SIZE) for cell in ret for _ in range(SAMPLE_SIZE // UNIT_SIZE)]
+    for (soft_level, infra_mod, _), arr in setup.schedule(
+            _task, units, key=itemgetter(1), label='Units: '):
+        ret[soft_level, infra_mod] += arr
     return ret
 
 
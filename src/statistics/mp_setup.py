@@ -2,13 +2,18 @@
 
 from __future__ import annotations
 
+import math
 import multiprocessing as mp
 import platform
+import queue
 import random
 import time
+from collections import defaultdict
 from os.path import isfile
 from subprocess import Popen
-from typing import Iterable, Callable
+from typing import Iterable, Callable, Hashable, Any, Generator
+
+import numpy as np
 
 PROCESSES = 8
 
@@ -42,6 +47,186 @@ def chunk(iterable: Iterable, count: int) -> list[list]:
     return chunked
 
 
+def seed_worker():
+    """ Pool initializer giving each worker its own random state,
+        as forked workers would otherwise all draw the same runs    """
+    random.seed()
+    np.random.seed()
+
+
+class Progress:
+    """ Counter of completed work, printing the throughput and
+        estimated time remaining at most every 'interval' seconds """
+
+    def __init__(self, total: int, label: str = '', interval: float = 5., done: int = 0):
+        """
+        Start counting
+        :param total: The amount of work to complete
+        :param label: Text to print before the counter
+        :param interval: Minimum seconds between prints
+        :param done: Work already completed before (e.g. when resuming),
+                     which doesn't count towards the throughput
+        """
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = self.initial = done
+        self.start = self.last = time.monotonic()
+        # Seconds remaining as estimated by the caller, see update
+        self.estimate: float | None = None
+
+    def update(self, count: int = 1, eta: float | None = None):
+        """ Count 'count' more completed work, printing if due. If work
+            varies in cost, the caller can give a better 'eta' in seconds """
+        self.done += count
+        self.estimate = eta
+        now = time.monotonic()
+        if now - self.last >= self.interval or self.done >= self.total:
+            self.last = now
+            print(self)
+
+    def rate(self) -> float:
+        """ Work completed per second since the start """
+        elapsed = time.monotonic() - self.start
+        return (self.done - self.initial) / elapsed if elapsed > 0 else 0.
+
+    def eta(self) -> float | None:
+        """ Estimated seconds until all work is completed, if known """
+        if self.estimate is not None:
+            return self.estimate
+        rate = self.rate()
+        return max(self.total - self.done, 0) / rate if rate > 0 else None
+
+    def __str__(self) -> str:
+        """ The counter, as a single line """
+        eta = self.eta()
+        remaining = '?' if eta is None else time.strftime('%H:%M:%S', time.gmtime(eta))
+        return f'{self.label}{self.done}/{self.total} ({self.done / max(self.total, 1):.0%}),' \
+               f' {self.rate():.1f}/s, ETA {remaining}'
+
+
+class CostModel:
+    """ Estimated seconds per unit of work, learned from completed units:
+        the mean time of units with the same key, or over all keys for keys
+        without completed units. Keys of which no unit has been handed out
+        yet are estimated infinite, so those are tried (and learned) first  """
+
+    def __init__(self):
+        self.seconds: defaultdict[Hashable, float] = defaultdict(float)
+        self.counts: defaultdict[Hashable, int] = defaultdict(int)
+        self.started: set[Hashable] = set()
+        self.total_seconds, self.total_count = 0., 0
+
+    def start(self, key: Hashable):
+        """ Note that a unit with 'key' was handed out """
+        self.started.add(key)
+
+    def observe(self, key: Hashable, seconds: float):
+        """ Learn from a unit with 'key' that took 'seconds' """
+        self.seconds[key] += seconds
+        self.counts[key] += 1
+        self.total_seconds += seconds
+        self.total_count += 1
+
+    def known(self, key: Hashable) -> float:
+        """ The expected seconds a unit with 'key' takes, by what is known """
+        if self.counts[key]:
+            return self.seconds[key] / self.counts[key]
+        return self.mean()
+
+    def mean(self) -> float:
+        """ The mean seconds over all completed units """
+        return self.total_seconds / self.total_count if self.total_count else 0.
+
+    def estimate(self, key: Hashable) -> float:
+        """ Like known, but infinite for keys not yet started """
+        return self.known(key) if key in self.started else math.inf
+
+
+def _timed(task: Callable, args: tuple) -> tuple[Any, float]:
+    """ Worker function: the result of a task, and the seconds it took """
+    start = time.perf_counter()
+    res = task(*args)
+    return res, time.perf_counter() - start
+
+
+def schedule(task: Callable, units: Iterable[tuple],
+             key: Callable[[tuple], Hashable] = lambda _: None,
+             processes: int = PROCESSES, label: str = '',
+             refill: Callable[[], Iterable[tuple]] | None = None,
+             total: int | None = None) -> Generator[tuple[tuple, Any]]:
+    """
+    Run a task over units of work in a pool, handing out units one at a time
+    as workers free up, so no worker idles while others hold a backlog
+    :param task: The function to run, module-level so workers can find it
+    :param units: The arguments of each call of task
+    :param key: Groups units of similar cost, for the cost model
+    :param processes: The amount of worker processes
+    :param label: Text to print before the progress counter
+    :param refill: Called whenever a worker is free but all units are handed
+                   out, for further units (based on the results so far).
+                   The schedule ends once it gives none and all units are done
+    :param total: The amount of units expected in all, if refill gives more
+    :return: Yields each unit with its result, in order of completion.
+             The most expensive units (by a CostModel) are handed out first,
+             keeping the tail short, and the ETA is the estimated remaining
+             cost divided by how fast the pool has been getting through cost
+    """
+    todo: defaultdict[Hashable, list[tuple]] = defaultdict(list)
+    for unit in units:
+        todo[key(unit)].append(unit)
+    model = CostModel()
+    queued = sum(len(group) for group in todo.values())
+    progress = Progress(queued if total is None else total, label)
+    done: queue.Queue = queue.Queue()
+    # Units handed out, by the order they were handed out in
+    running: dict[int, tuple] = {}
+    handed, start, spent = 0, time.monotonic(), 0.
+    # Whether refill might still give units
+    open_ended = refill is not None
+
+    with mp.Pool(processes, seed_worker) as pool:
+        while True:
+            # Keep every worker busy, with a unit queued for when it finishes
+            while len(running) < 2 * processes:
+                if not todo and open_ended:
+                    for unit in refill():
+                        todo[key(unit)].append(unit)
+                    open_ended = bool(todo) or bool(running)
+                if not todo:
+                    break
+                group = max(todo, key=model.estimate)
+                unit = todo[group].pop()
+                model.start(group)
+                if not todo[group]:
+                    del todo[group]
+                running[handed] = unit
+                pool.apply_async(_timed, (task, unit),
+                                 callback=lambda res, index=handed: done.put((index, res)),
+                                 error_callback=lambda exc: done.put((None, exc)))
+                handed += 1
+            if not running:
+                break
+
+            index, res = done.get()
+            if index is None:
+                raise res
+            unit = running.pop(index)
+            res, seconds = res
+            model.observe(key(unit), seconds)
+            spent += seconds
+
+            # Queued and half of the running units, and any units refill is expected to give
+            queued = sum(len(group_units) for group_units in todo.values())
+            remaining = sum(model.known(group) * len(group_units)
+                            for group, group_units in todo.items()) \
+                + sum(model.known(key(unit)) for unit in running.values()) / 2 \
+                + max(progress.total - handed - queued, 0) * model.mean()
+            speed = spent / (time.monotonic() - start)
+            progress.update(eta=remaining / speed if speed else None)
+            yield unit, res
+
+
 def worker(boilerplate: tuple[Callable, list]) -> dict:
     """ Execute a task for all arguments in the list, then
         return a mapping from arguments to return values   """
@@ -52,14 +237,12 @@ def worker(boilerplate: tuple[Callable, list]) -> dict:
     time.sleep(0.2)
     number = int(mp.current_process().name.split('-')[-1])
 
-    for step, args in enumerate(arglist):
-        print(f'{step / len(arglist):.0%}'.rjust(number * 5))
+    if not arglist:
+        print(f'Worker {number}: empty')
+    progress = Progress(len(arglist), f'Worker {number}: ', interval=60)
+    for args in arglist:
         res[args] = task(*args)
-
-    if arglist:
-        print('done!'.rjust(number * 5))
-    else:
-        print('empty'.rjust(number * 5))
+        progress.update()
 
     return res
 
@@ -0,0 +1,151 @@
+""" Quantiles of scores: a mergeable streaming sketch, and percentiles of histograms """
+
+from __future__ import annotations
+
+import math
+import random
+from typing import Iterable, Sequence
+
+import numpy as np
+
+
+class QuantileSketch:
+    """ Streaming quantile sketch (KLL): scores are kept in levels, where a
+        score at level h stands for 2 ** h scores. A level over its capacity
+        is sorted and every other score (from a random start) is promoted,
+        so the sketch holds O(k) scores for any amount of scores, with rank
+        error around 1.7 / k. Sketches of the same scores in parts (like
+        those of worker processes) merge into a sketch of all scores       """
+
+    def __init__(self, k: int = 200, seed: int | None = None):
+        """
+        Create an empty sketch
+        :param k: Capacity of the top level, trading size for accuracy
+        :param seed: Seed for the choices of which scores to promote
+        """
+        self.k = k
+        self.levels: list[list[float]] = [[]]
+        self.count = 0
+        self._rng = random.Random(seed)
+
+    def _capacity(self, level: int) -> int:
+        """ How many scores a level holds, shrinking geometrically below the top """
+        return max(2, math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1)))
+
+    def _compress(self):
+        """ Promote half of the scores of each level over its capacity """
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items.sort()
+                # An odd score stays behind, so the weights add up exactly
+                keep = [items.pop()] if len(items) % 2 else []
+                self.levels[level + 1].extend(items[self._rng.random() < .5::2])
+                self.levels[level] = keep
+            level += 1
+
+    def update(self, score: float):
+        """ Add a single score """
+        self.levels[0].append(score)
+        self.count += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def extend(self, scores: Iterable[float]):
+        """ Add many scores """
+        scores = list(scores)
+        self.levels[0].extend(scores)
+        self.count += len(scores)
+        self._compress()
+
+    def merge(self, other: QuantileSketch) -> QuantileSketch:
+        """ Add the scores of another sketch to this one, returning this sketch """
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self._compress()
+        return self
+
+    def _weighted(self) -> tuple[np.ndarray, np.ndarray]:
+        """ The held scores in sorted order, with their cumulative weights """
+        scores = np.concatenate([np.asarray(items, dtype=float) for items in self.levels])
+        weights = np.concatenate([np.full(len(items), 2 ** level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(scores, kind='stable')
+        return scores[order], np.cumsum(weights[order])
+
+    def quantiles(self, quantiles: Sequence[float]) -> np.ndarray:
+        """ The first score whose (estimated) cumulative count reaches
+            each fraction of all scores, NaN if there are no scores     """
+        if not self.count:
+            return np.full(len(quantiles), np.nan)
+        scores, cumulative = self._weighted()
+        index = np.searchsorted(cumulative, np.asarray(quantiles) * cumulative[-1])
+        return scores[np.minimum(index, len(scores) - 1)]
+
+    def quantile(self, quantile: float) -> float:
+        """ The score at a single quantile, see quantiles """
+        return float(self.quantiles([quantile])[0])
+
+    def tail_mean(self, quantile: float) -> float:
+        """ The (estimated) mean of the scores above the given quantile """
+        if not self.count:
+            return math.nan
+        scores, cumulative = self._weighted()
+        start = min(int(np.searchsorted(cumulative, quantile * cumulative[-1], side='right')),
+                    len(scores) - 1)
+        weights = np.diff(cumulative, prepend=0)[start:]
+        return float(scores[start:] @ weights / weights.sum())
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """ The sketch as arrays, to save with numpy (see from_arrays) """
+        return {'scores': np.concatenate([np.asarray(items, dtype=float) for items in self.levels]),
+                'sizes': np.array([len(items) for items in self.levels]),
+                'count': np.array(self.count), 'k': np.array(self.k)}
+
+    @classmethod
+    def from_arrays(cls, scores: np.ndarray, sizes: np.ndarray,
+                    count: np.ndarray, k: np.ndarray) -> QuantileSketch:
+        """ Create a sketch from the arrays given by arrays() """
+        sketch = cls(int(k))
+        bounds = np.cumsum(sizes)
+        sketch.levels = [scores[stop - size:stop].tolist() for size, stop in zip(sizes, bounds)]
+        sketch.count = int(count)
+        return sketch
+
+    def __len__(self) -> int:
+        """ The amount of scores added """
+        return self.count
+
+    def __repr__(self) -> str:
+        """ Represent the sketch in a short format """
+        return f'QuantileSketch({self.count} scores, {sum(map(len, self.levels))} held)'
+
+
+def histogram_percentiles(hists: np.ndarray, quantiles: Sequence[float],
+                          bin_size: float = 1) -> np.ndarray:
+    """
+    The percentiles of many histograms at once, without looping over them
+    :param hists: Counts per bin along the last axis, any shape before it
+    :param quantiles: The fractions to find the percentiles of
+    :param bin_size: The width of the bins, which start at 0
+    :return: For each histogram and quantile, the start of the first bin at which the
+             cumulative count reaches that fraction of the total, of shape
+             hists.shape[:-1] + (len(quantiles),)
+    """
+    hists = np.asarray(hists)
+    bins = hists.shape[-1]
+    cumsum = hists.reshape(-1, bins).cumsum(axis=1, dtype=np.int64)
+    totals = cumsum[:, -1]
+    # Offsetting each row by more than any total makes all rows one sorted array
+    stride = int(totals.max(initial=0)) + 1
+    offsets = np.arange(len(cumsum), dtype=np.int64)[:, None] * stride
+    thresholds = np.ceil(totals[:, None] * np.asarray(quantiles)[None, :]).astype(np.int64)
+    index = np.searchsorted((cumsum + offsets).ravel(), thresholds + offsets) \
+        - np.arange(len(cumsum))[:, None] * bins
+    return (index * bin_size).reshape(*hists.shape[:-1], len(quantiles))